@@ -0,0 +1,83 @@
+"""Stand-in for the Thorium Reader executable, serving the epub it is started with from a `MockDevToolsServer`.
+
+It accepts the same command line as Thorium Reader (`<epub> --remote-debugging-port=N ...`), prints the
+"DevTools listening on" line Chromium prints and runs until it is terminated. The mock server is configured
+with the JSON object in the LCP_BENCH_MOCK environment variable (the keyword arguments of `MockDevToolsServer`).
+
+Like Thorium Reader, it only runs once: while the instance recorded in the file named by the "instance_file"
+key of the configuration is running, starting it again forwards the epub to that instance and exits.
+
+Usage:
+    python -m benchmarks.fake_thorium book.epub --remote-debugging-port=0
+"""
+import asyncio
+import json
+import os
+import sys
+import threading
+
+import websockets
+
+from benchmarks.mock_devtools import MockDevToolsServer
+
+CONFIG_VARIABLE = "LCP_BENCH_MOCK"
+
+
+async def serve(epub_path: str, port: int):
+    """Serve `epub_path` until cancelled, or open it in the running instance."""
+    config = json.loads(os.environ.get(CONFIG_VARIABLE, "{}"))
+    instance_file: str | None = config.pop("instance_file", None)
+    if instance_file is not None and await _forward(instance_file, epub_path):
+        return
+    server = MockDevToolsServer(epub_path, **config)
+    await server.start(port=port)
+    try:
+        if instance_file is not None:
+            with open(instance_file, "w", encoding="utf-8") as f:
+                f.write(server.browser_ws_url)
+        print(f"\nDevTools listening on {server.browser_ws_url}", file=sys.stderr, flush=True)
+        await asyncio.Future()
+    finally:
+        await server.close()
+
+
+async def _forward(instance_file: str, epub_path: str):
+    try:
+        with open(instance_file, encoding="utf-8") as f:
+            browser_ws_url = f.read()
+        async with websockets.connect(browser_ws_url) as websocket:
+            message = {"id": 1, "method": "Mock.openPublication", "params": {"path": os.path.abspath(epub_path)}}
+            await websocket.send(json.dumps(message))
+            await websocket.recv()
+    except (OSError, websockets.InvalidURI, websockets.InvalidHandshake):
+        return False  # No instance running
+    return True
+
+
+def _exit_with_parent():
+    # On Windows the launcher starts a .cmd wrapper, terminating it does not terminate this process
+    import ctypes  # pylint: disable=import-outside-toplevel
+
+    synchronize, infinite = 0x00100000, 0xFFFFFFFF
+    parent = ctypes.windll.kernel32.OpenProcess(synchronize, False, os.getppid())  # type: ignore
+    if parent:
+        ctypes.windll.kernel32.WaitForSingleObject(parent, infinite)  # type: ignore
+        os._exit(0)  # pylint: disable=protected-access
+
+
+def main(argv: list[str]):
+    epub_path = next(arg for arg in argv if not arg.startswith("--"))
+    port = 0
+    for arg in argv:
+        if arg.startswith("--remote-debugging-port="):
+            port = int(arg.split("=", 1)[1])
+    if sys.platform.startswith("win"):
+        threading.Thread(target=_exit_with_parent, daemon=True).start()
+    try:
+        asyncio.run(serve(epub_path, port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,181 @@
+"""Check that the fast xhtml filters match the BeautifulSoup filter on a corpus of generated chapters.
+
+`utils.filter.filter_xhtml` only rewrites the prolog and <head> and falls back to BeautifulSoup for markup it
+does not handle, and `utils.filter.filter_xhtml_bytes`, used on fetched files, does the same on their bytes.
+Their output has to be byte-identical to the BeautifulSoup filter it replaced, except for the body:
+BeautifulSoup re-serializes the body, while the fast filter keeps it as it was. The chapters of the corpus therefore
+get bodies already in BeautifulSoup's serialized form, so both filters must agree on the whole document.
+
+The corpus mixes hand-written edge cases with chapters varying the XML declaration, DOCTYPE, byte order mark,
+line endings, html attributes, head elements, entities and the case of tag names.
+
+Usage:
+    python -m benchmarks.filter_corpus --chapters 240 --seed 0
+"""
+import argparse
+import random
+import sys
+import time
+
+from utils.filter import _filter_head, _filter_with_soup, _Unsupported, filter_xhtml, filter_xhtml_bytes
+
+# Edge cases of the prolog and head, the bodies are replaced by their BeautifulSoup form like in generated chapters
+EDGE_CASES = {
+    "basic": '<?xml version="1.0" encoding="UTF-8"?>\n<!DOCTYPE html>\n<html xmlns="http://www.w3.org/1999/xhtml" '
+             'xmlns:epub="http://www.idpf.org/2007/ops" data-readium-x="1" lang="en">\n<head>\n<title>Ch &amp; 1'
+             '</title>\n<link href="../Styles/style.css" rel="stylesheet" type="text/css"/>\n<meta charset="utf-8"/>'
+             '\n<script>var a = 1 < 2;</script>\n<style>p{}</style>\n</head>\n<body><p>Hi</p></body>\n</html>',
+    "meta_before_title": '<html><head><meta name="a" content="b"/><title>T</title><link rel="stylesheet" '
+                         'href="readium-css/x.css"/><link rel="stylesheet" href="a.css"/></head><body><p>x</p>'
+                         '</body></html>',
+    "link_alternate": '<html><head><title>T</title><link rel="alternate stylesheet" href="a.css"/><link rel="icon" '
+                      'href="i.png"/></head><body></body></html>',
+    "uppercase": '<HTML><HEAD><TITLE>T</TITLE><LINK REL="stylesheet" HREF="a.css"></HEAD><BODY></BODY></HTML>',
+    "title_nbsp": '<html><head><title>A&nbsp;B</title></head><body>x</body></html>',
+    "attr_quotes": '<html><head><meta content=\'say "hi"\' name="d"/><title>x</title></head><body/></html>',
+    "comment_in_head": '<html><head><!-- c --><title>t</title></head><body></body></html>',
+    "title_whitespace": '<html><head><title>\n  Spaced  \n</title></head><body></body></html>',
+    "title_empty": '<html><head><title></title></head><body></body></html>',
+    "two_titles": '<html><head><title>a</title><title>b</title></head><body></body></html>',
+    "html_readium": '<html style="--USER__x: 1" data-readium="y" READIUM-Z="q"><head><title>a</title></head>'
+                    '<body></body></html>',
+    "noscript_meta": '<html><head><noscript><meta name="x" content="y"/></noscript><title>a</title></head>'
+                     '<body></body></html>',
+    "rel_uppercase": '<html><head><link rel="Stylesheet" href="a.css"/></head><body></body></html>',
+    "base": '<html><head><base href="x"/><title>a</title></head><body></body></html>',
+    "title_escaped": '<html><head><title>a &lt; b &gt; c</title></head><body></body></html>',
+    "attr_amp": '<html><head><link rel="stylesheet" href="a.css?x=1&amp;y=2"/></head><body></body></html>',
+    "void_unclosed": '<html><head><link rel="stylesheet" href="a.css"><meta charset="utf-8"></head><body></body>'
+                     '</html>',
+    "xml_lang": '<html xmlns="http://www.w3.org/1999/xhtml" xml:lang="en"><head><title>a</title></head><body>'
+                '</body></html>',
+    "doctype_public": '<!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.1//EN" '
+                      '"http://www.w3.org/TR/xhtml11/DTD/xhtml11.dtd">\n<html><head><title>a</title></head><body>'
+                      '</body></html>',
+    "script_head_end": '<html><head><script>document.write("</head>")</script><title>a</title></head><body></body>'
+                       '</html>',
+    "boolean_attr": '<html><head><meta itemprop name="x"/><title>a</title></head><body></body></html>',
+    "duplicate_attr": '<html><head><meta name="a" name="b"/><title>a</title></head><body></body></html>',
+    "title_attrs": '<html><head><title id="t" dir="ltr">a</title></head><body></body></html>',
+    "unknown_entity_attr": '<html><head><meta content="a&foo;b" name="x"/></head><body></body></html>',
+    "unterminated_entity_attr": '<html><head><meta content="a&copy b" name="x"/></head><body></body></html>',
+    "numeric_title": '<html><head><title>&#169; &#x41;</title></head><body></body></html>',
+    "cdata": '<html><head><style><![CDATA[p{}]]></style><title>a</title></head><body></body></html>',
+    "attr_case": '<html xmlns:epub="x" EPUB:type="y"><head></head><body></body></html>',
+    "attr_whitespace": '<html><head><link\trel="stylesheet"\n href="a.css"/></head><body></body></html>',
+    "class_list": '<html class="  a   b "><head></head><body></body></html>',
+    "rel_padded": '<html><head><link rel=" stylesheet " href="a.css"/></head><body></body></html>',
+    "attr_lt": '<html><head><meta content="a<b>c" name="x"/></head><body></body></html>',
+    "attr_gt": '<html><head><meta content="a>b" name="x"/></head><body></body></html>',
+    "crlf": '<?xml version="1.0" encoding="utf-8"?>\r\n<html>\r\n<head>\r\n<title>a</title>\r\n</head>\r\n'
+            '<body>\r\n<p>x</p>\r\n</body>\r\n</html>\r\n',
+}
+
+_XML_DECLARATIONS = ('', '<?xml version="1.0" encoding="utf-8"?>\n', '<?xml version="1.0" encoding="UTF-8"?>\n',
+                     "<?xml version='1.0' encoding='utf-8' standalone='no'?>\n", '<?xml version="1.0"?>\n')
+_DOCTYPES = ('', '<!DOCTYPE html>\n', '<!doctype html>\n',
+             '<!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.1//EN" "http://www.w3.org/TR/xhtml11/DTD/xhtml11.dtd">\n')
+_HTML_ATTRIBUTES = ('xmlns="http://www.w3.org/1999/xhtml"', 'xmlns:epub="http://www.idpf.org/2007/ops"',
+                    'lang="fr"', 'xml:lang="en-GB"', 'data-readium-version="2"', 'style="--USER__fontSize: 100%"',
+                    'class=" chapter  odd "', "dir='ltr'", 'READIUM-theme="night"')
+_TITLES = ("Chapter {n}", "Tom &amp; Jerry {n}", "L&#8217;été {n}", "A&nbsp;{n}", "1 &lt; {n}",
+           "« Guillemets » {n}", "\n  Spaced {n}\n")
+_HEAD_ELEMENTS = (
+    '<link href="../Styles/style.css" rel="stylesheet" type="text/css"/>',
+    "<link rel='stylesheet' href='style{n}.css'>",
+    '<link href="readium-css/ReadiumCSS-before.css" rel="stylesheet"/>',
+    '<link href="https://thorium/fonts.css" rel="stylesheet"/>',
+    '<link rel="icon" href="favicon.png"/>',
+    '<link rel="alternate stylesheet" title="night" href="night.css"/>',
+    '<meta charset="utf-8"/>',
+    '<meta name="viewport" content="width=device-width, initial-scale=1"/>',
+    '<meta content="a &amp; b" name="description">',
+    '<script type="text/javascript">if (a < b && c > d) { run("x"); }</script>',
+    '<script src="../js/readium.js"></script>',
+    '<style>body { margin: 0 } p > em { color: red }</style>',
+    '<noscript><link rel="stylesheet" href="noscript.css"/></noscript>',
+    '<base href="httpsr2://id/pub/book/"/>',
+    '<!-- injected by the reader -->',
+)
+_WORDS = ("lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor incididunt ut labore et "
+          "dolore magna aliqua").split()
+
+
+def generate_chapter(rng: random.Random, n: int):
+    """A chapter with a randomly composed prolog and head, before its body is put in BeautifulSoup's form."""
+    newline = "\r\n" if rng.random() < 0.05 else "\n"
+    prolog = ("\ufeff" if rng.random() < 0.1 else "") + rng.choice(_XML_DECLARATIONS) + rng.choice(_DOCTYPES)
+    attributes = " ".join(rng.sample(_HTML_ATTRIBUTES, rng.randint(0, 5)))
+    head_elements = [element.replace("{n}", str(n)) for element in rng.sample(_HEAD_ELEMENTS, rng.randint(0, 8))]
+    if rng.random() < 0.9:
+        title = rng.choice(_TITLES).replace("{n}", str(n))
+        head_elements.insert(rng.randint(0, len(head_elements)), f"<title>{title}</title>")
+    indent = rng.choice(("", "  ", "\t"))
+    head = newline.join(indent + element for element in head_elements)
+    paragraphs = []
+    for _ in range(rng.randint(1, 20)):
+        words = " ".join(rng.choice(_WORDS) for _ in range(rng.randint(5, 60)))
+        paragraphs.append(rng.choice(("<p>{}</p>", "<p class=\"x\">{}<br/></p>", "<p><em>{}</em> &amp; more</p>",
+                                      "<div><img src=\"a.jpg\" alt=\"{}\"/></div>")).format(words))
+    document = (f"{prolog}<html{' ' if attributes else ''}{attributes}>{newline}<head>{newline}{head}{newline}"
+                f"</head>{newline}<body>{newline}{newline.join(paragraphs)}{newline}</body>{newline}</html>{newline}")
+    if rng.random() < 0.1:
+        for name in ("html", "head", "title", "link", "meta", "body"):
+            document = document.replace(f"<{name}", f"<{name.upper()}").replace(f"</{name}>", f"</{name.upper()}>")
+    return document
+
+
+def with_soup_body(document: str):
+    """The document with everything after its head replaced by how the BeautifulSoup filter serializes it."""
+    head_end = document.lower().rfind("</head>")
+    if head_end < 0:
+        return document
+    expected = _filter_with_soup(document)
+    return document[:head_end + len("</head>")] + expected[expected.rfind("</head>") + len("</head>"):]
+
+
+def compare(documents: dict[str, str], verbose: bool = False):
+    """Filter every document with the fast filters, as text and as UTF-8 bytes, and with the BeautifulSoup filter.
+
+    Returns:
+        The number of documents that took the fast path, and the names of those whose outputs differ.
+    """
+    fast = 0
+    different: list[str] = []
+    for name, document in documents.items():
+        try:
+            _filter_head(document)
+            fast += 1
+        except _Unsupported:
+            pass
+        expected = _filter_with_soup(document)
+        for path, actual in (("text", filter_xhtml(document)),
+                             ("bytes", filter_xhtml_bytes(document.encode("utf-8")).decode("utf-8"))):
+            if actual != expected:
+                different.append(f"{name} ({path})")
+                if verbose:
+                    print(f"{name} ({path}):\n  fast: {actual[:300]!r}\n  soup: {expected[:300]!r}")
+    return fast, different
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description="Compare the fast xhtml filter with the BeautifulSoup filter.")
+    parser.add_argument("--chapters", type=int, default=240, help="number of generated chapters")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--verbose", action="store_true", help="show the start of every differing output")
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    corpus = {f"edge case {name}": with_soup_body(document) for name, document in EDGE_CASES.items()}
+    corpus.update((f"chapter {n}", with_soup_body(generate_chapter(rng, n))) for n in range(args.chapters))
+    start = time.perf_counter()
+    fast_count, differences = compare(corpus, args.verbose)
+    print(f"{len(corpus)} documents, {fast_count} on the fast path, {len(differences)} outputs different "
+          f"({time.perf_counter() - start:.1f}s)")
+    if differences:
+        print(f"Different: {', '.join(differences)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
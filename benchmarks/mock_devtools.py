@@ -0,0 +1,306 @@
+"""A mock of Thorium Reader's remote debugger, serving a synthetic epub over the DevTools protocol.
+
+It speaks the part of the protocol the fetcher uses: target discovery and `Target.closeTarget` on the
+browser endpoint, `Page.getFrameTree`, `Runtime.enable` with its execution context events and
+`Runtime.evaluate` of the expressions built by `utils.fetch` and `utils.context` on the reader targets.
+Evaluated expressions are interpreted in Python instead of being run in a JavaScript engine. More
+publications are opened with `open_publication`, like Thorium Reader does when its executable is started
+again with a file.
+"""
+import asyncio
+import base64
+import json
+import re
+import zipfile
+from typing import Any
+from urllib.parse import unquote
+
+import websockets
+
+from benchmarks.synthetic_epub import scramble
+from utils.manifest import ManifestIndex
+
+# Where the mock reader serves publications from, in the same shape as Thorium's URLs
+PUBLICATION_URL = "httpsr2://id/pub/{}/0/"
+
+# Calls of the page-side helper, see `utils.fetch.page_call`
+_PAGE_CALL_RE = re.compile(r"^\(globalThis\.__lcpFetcher \?\?= .*\)\.(\w+)\((.*)\)$", re.S)
+
+
+class _Publication:
+    """A synthetic epub opened in the mock reader."""
+
+    def __init__(self, epub_path: str, number: int):
+        self.index = ManifestIndex.from_epub(epub_path)
+        self.zip = zipfile.ZipFile(epub_path, 'r')
+        self.encrypted = {item.zip_path for item in self.index.encrypted_items()}
+        self.base_url = PUBLICATION_URL.format(base64.b64encode(f"book{number}".encode()).decode())
+        self.target_id = f"READER{number}"
+        self.origin = self.base_url[:self.base_url.index("/", len("httpsr2://"))]
+        self.main_context_id: int | None = None
+        self.context_id: int | None = None  # Execution context of the reader frame, None while it reloads
+        self.evaluates = 0
+        first = next((item for item in self.index.items.values()
+                      if item.media_type.startswith("application/xhtml+xml")), None)
+        self.reader_url = self.base_url + (first.url_path if first is not None else "")
+
+    def read(self, zip_path: str):
+        if zip_path not in self.zip.NameToInfo:
+            return None
+        data = self.zip.read(zip_path)
+        return scramble(data) if zip_path in self.encrypted else data
+
+
+class MockDevToolsServer:
+    """Serves the decrypted resources of synthetic epubs (see `benchmarks.synthetic_epub`) like Thorium Reader.
+
+    Every evaluate reply is delayed by `latency` plus the time its payload takes at `bandwidth`,
+    and every xhtml file gets `head_size` bytes of scripts and styles injected into its <head>,
+    like the ones the reader adds and `utils.filter` removes. With `reload_every`, the reader frame
+    reloads after that many evaluates: its execution context is destroyed, evaluates still running
+    in it fail, and a new context is created shortly after.
+
+    Usage:
+        async with MockDevToolsServer(epub_path, latency=0.005) as server:
+            browser_ws_url = server.browser_ws_url
+    """
+
+    def __init__(self, epub_path: str, latency: float = 0.0, bandwidth: float | None = None, head_size: int = 4096,
+                 reader_delay: float = 0.1, reload_every: int | None = None):
+        """
+        Args:
+            epub_path: _path to the synthetic epub opened on startup_
+            latency: _seconds every Runtime.evaluate reply is delayed by_
+            bandwidth: _bytes per second replies are sent at, unlimited if None_
+            head_size: _bytes of scripts and styles injected into the head of every xhtml file_
+            reader_delay: _seconds between opening a publication and its reader target appearing_
+            reload_every: _number of evaluates after which the reader frame reloads, never if None_
+        """
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.head_size = head_size
+        self.reader_delay = reader_delay
+        self.reload_every = reload_every
+        self.port: int | None = None
+        self.counts: dict[str, int] = {}
+        self._publications: dict[str, _Publication] = {}  # By target id
+        self._opened = 0
+        self._discovering: set[Any] = set()
+        self._runtime_clients: dict[str, set[Any]] = {}  # Connections with Runtime enabled, by target id
+        self._next_context = 1
+        self._buffers: dict[int, bytes] = {}
+        self._next_handle = 1
+        self._server: Any = None
+        self._add_publication(epub_path)
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info: object):
+        await self.close()
+
+    @property
+    def browser_ws_url(self):
+        """webSocketDebuggerUrl of the browser target, as announced by "DevTools listening on"."""
+        return f"ws://127.0.0.1:{self.port}/devtools/browser/mock"
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0):
+        """Start listening, on an ephemeral port by default."""
+        self._server = await websockets.serve(self._handle_connection, host, port, max_size=None)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        """Stop the server."""
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        for publication in self._publications.values():
+            publication.zip.close()
+
+    def open_publication(self, epub_path: str):
+        """Open another epub, announcing its reader target to every browser connection discovering targets."""
+        publication = self._add_publication(epub_path)
+        for websocket in self._discovering:
+            asyncio.create_task(self._announce_reader(websocket, publication))
+
+    def _add_publication(self, epub_path: str):
+        self._opened += 1
+        publication = _Publication(epub_path, self._opened)
+        publication.main_context_id = self._new_context_id()
+        publication.context_id = self._new_context_id()
+        self._publications[publication.target_id] = publication
+        return publication
+
+    def resource(self, url: str):
+        """Decrypted content of the resource at a publication URL, None if there is no such resource."""
+        publication = next((p for p in self._publications.values() if url.startswith(p.base_url)), None)
+        if publication is None:
+            return None
+        zip_path = unquote(url[len(publication.base_url):])
+        data = publication.read(zip_path)
+        item = publication.index.get(zip_path)
+        if data is not None and item is not None and item.media_type.startswith("application/xhtml+xml"):
+            data = self._inject_head(data)
+        return data
+
+    def _inject_head(self, data: bytes):
+        filler = "/* reader */" * (self.head_size // 24 + 1)
+        injected = (f'<script type="text/javascript">{filler}</script>'
+                    f'<style type="text/css">{filler}</style>').encode("utf-8")
+        return data.replace(b"<head>", b"<head>" + injected, 1)
+
+    async def _handle_connection(self, websocket: Any):
+        target_id = websocket.request.path.rsplit("/", 1)[-1]
+        try:
+            async for message in websocket:
+                asyncio.create_task(self._handle_message(websocket, target_id, json.loads(message)))
+        finally:
+            self._discovering.discard(websocket)
+            self._runtime_clients.get(target_id, set()).discard(websocket)
+
+    async def _handle_message(self, websocket: Any, target_id: str, message: dict[str, Any]):
+        method: str = message["method"]
+        self.counts[method] = self.counts.get(method, 0) + 1
+        params = message.get("params", {})
+        reply: dict[str, Any] = {"id": message["id"]}
+        publication = self._publications.get(target_id)
+        if method == "Runtime.enable" and publication is not None:
+            self._runtime_clients.setdefault(target_id, set()).add(websocket)
+            # Existing contexts are announced before the reply
+            await websocket.send(_context_created(publication.main_context_id, "file://", "MAIN"))
+            if publication.context_id is not None:
+                await websocket.send(_context_created(publication.context_id, publication.origin, "READER"))
+            reply["result"] = {}
+        elif method in ("Runtime.enable", "Page.enable"):
+            reply["result"] = {}
+        elif method == "Page.getFrameTree" and publication is not None:
+            reply["result"] = {"frameTree": {
+                "frame": {"id": "MAIN", "url": "file:///index_reader.html"},
+                "childFrames": [{"frame": {"id": "READER", "url": publication.reader_url}}],
+            }}
+        elif method == "Target.setDiscoverTargets":
+            reply["result"] = {}
+            self._discovering.add(websocket)
+            asyncio.create_task(self._announce_targets(websocket))
+        elif method == "Target.closeTarget" and params.get("targetId") in self._publications:
+            self._publications.pop(params["targetId"]).zip.close()
+            reply["result"] = {"success": True}
+            for browser in self._discovering:
+                await browser.send(json.dumps({"method": "Target.targetDestroyed",
+                                               "params": {"targetId": params["targetId"]}}))
+        elif method == "Mock.openPublication":
+            self.open_publication(params["path"])
+            reply["result"] = {}
+        elif method == "Runtime.evaluate" and not self._has_context(publication, params.get("contextId")):
+            reply["error"] = {"code": -32000, "message": "Cannot find context with specified id"}
+        elif method == "Runtime.evaluate":
+            reply["result"] = self._evaluate(params["expression"], publication, params.get("contextId"))
+            delay = self.latency
+            if self.bandwidth:
+                delay += len(json.dumps(reply)) / self.bandwidth
+            if publication is not None:
+                self._count_evaluate(publication)
+            await asyncio.sleep(delay)
+            if not self._has_context(publication, params.get("contextId")):
+                del reply["result"]
+                reply["error"] = {"code": -32000, "message": "Execution context was destroyed."}
+        else:
+            reply["error"] = {"code": -32601, "message": f"'{method}' wasn't found"}
+        await websocket.send(json.dumps(reply))
+
+    async def _announce_targets(self, websocket: Any):
+        library = {"targetId": "LIBRARY", "type": "page", "url": "file:///index_library.html"}
+        await websocket.send(json.dumps({"method": "Target.targetCreated", "params": {"targetInfo": library}}))
+        for publication in list(self._publications.values()):
+            await self._announce_reader(websocket, publication)
+
+    async def _announce_reader(self, websocket: Any, publication: _Publication):
+        await asyncio.sleep(self.reader_delay)
+        reader = {"targetId": publication.target_id, "type": "webview", "url": publication.reader_url}
+        await websocket.send(json.dumps({"method": "Target.targetCreated", "params": {"targetInfo": reader}}))
+
+    def _new_context_id(self):
+        self._next_context += 1
+        return self._next_context - 1
+
+    @staticmethod
+    def _has_context(publication: _Publication | None, context_id: int | None):
+        if publication is None or context_id is None:
+            return True
+        return context_id in (publication.main_context_id, publication.context_id)
+
+    def _count_evaluate(self, publication: _Publication):
+        publication.evaluates += 1
+        if self.reload_every and publication.evaluates % self.reload_every == 0 and publication.context_id is not None:
+            asyncio.create_task(self._reload(publication))
+
+    async def _reload(self, publication: _Publication):
+        destroyed = json.dumps({"method": "Runtime.executionContextDestroyed",
+                                "params": {"executionContextId": publication.context_id}})
+        publication.context_id = None
+        for websocket in list(self._runtime_clients.get(publication.target_id, ())):
+            await websocket.send(destroyed)
+        await asyncio.sleep(self.reader_delay)
+        publication.context_id = self._new_context_id()
+        created = _context_created(publication.context_id, publication.origin, "READER")
+        for websocket in list(self._runtime_clients.get(publication.target_id, ())):
+            await websocket.send(created)
+
+    def _evaluate(self, expression: str, publication: _Publication | None = None,
+                  context_id: int | None = None) -> dict[str, Any]:
+        if expression.strip() == "location.href" and publication is not None:
+            in_reader = context_id is not None and context_id == publication.context_id
+            href = publication.reader_url if in_reader else "file:///index_reader.html"
+            return {"result": {"type": "string", "value": href}}
+        call = _PAGE_CALL_RE.match(expression.strip())
+        if call is not None:
+            value = self._page_call(call.group(1), json.loads(f"[{call.group(2)}]"))
+        else:
+            return {"result": {"type": "undefined"},
+                    "exceptionDetails": {"text": "Uncaught", "exception": {"description": "Unsupported expression"}}}
+        return {"result": {"type": "object", "value": value}}
+
+    def _page_call(self, method: str, args: list[Any]) -> dict[str, Any]:
+        if method == "open":
+            url, chunk_size = args
+            data = self.resource(url)
+            if data is None:
+                return _not_found()
+            result: dict[str, Any] = {"success": True, "size": len(data), "base64": _encode(data[:chunk_size])}
+            if len(data) > chunk_size:
+                result["handle"] = self._next_handle
+                self._buffers[self._next_handle] = data
+                self._next_handle += 1
+            return result
+        if method == "read":
+            handle, offset, length = args
+            if handle not in self._buffers:
+                return {"error": f"Unknown handle {handle}"}
+            return {"success": True, "base64": _encode(self._buffers[handle][offset:offset + length])}
+        if method == "close":
+            self._buffers.pop(args[0], None)
+            return {"success": True}
+        if method == "fetchText":
+            return self._fetch_text(args[0])
+        if method == "fetchTexts":
+            return {"success": True, "items": [self._fetch_text(url) for url in args[0]]}
+        return {"error": f"TypeError: __lcpFetcher.{method} is not a function"}
+
+    def _fetch_text(self, url: str) -> dict[str, Any]:
+        data = self.resource(url)
+        return _not_found() if data is None else {"success": True, "base64": _encode(data)}
+
+
+def _context_created(context_id: int | None, origin: str, frame_id: str):
+    context = {"id": context_id, "origin": origin, "name": "", "uniqueId": f"mock-{context_id}",
+               "auxData": {"isDefault": True, "type": "default", "frameId": frame_id}}
+    return json.dumps({"method": "Runtime.executionContextCreated", "params": {"context": context}})
+
+
+def _encode(data: bytes):
+    return base64.b64encode(data).decode("ascii")
+
+
+def _not_found():
+    return {"error": "Fetch failed: 404 Not Found"}
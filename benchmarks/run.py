@@ -0,0 +1,256 @@
+"""Offline benchmark of `utils.reader.ReaderSession` against the mock reader of `benchmarks.fake_thorium`.
+
+Synthetic epubs are generated once, then every repetition fetches copies of them through one session in a
+fresh process with an empty fetch cache, so peak RSS and timings are not carried over between runs.
+With `--books` above 1 the later books reuse the running mock reader, which shows the launch cost amortized.
+The cold start of the command line (time until it exits on `--help` or on a missing epub) is measured too.
+Results are written as JSON to compare across runs and revisions.
+
+Usage:
+    python -m benchmarks.run --chapters 200 --images 20 --latency 0.005 --repeat 3 --output results.json
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import platform
+import shutil
+import stat
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any
+
+from benchmarks.fake_thorium import CONFIG_VARIABLE
+from benchmarks.synthetic_epub import LAYOUTS, generate_epub
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def peak_rss():
+    """Peak resident set size of the current process in bytes, None if it cannot be measured."""
+    try:
+        import resource  # pylint: disable=import-outside-toplevel
+    except ImportError:
+        return _windows_peak_rss()
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return usage if sys.platform == "darwin" else usage * 1024
+
+
+def _windows_peak_rss():
+    try:
+        import ctypes  # pylint: disable=import-outside-toplevel
+        from ctypes import wintypes  # pylint: disable=import-outside-toplevel
+    except ImportError:
+        return None
+
+    class ProcessMemoryCounters(ctypes.Structure):
+        _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD)] + [
+            (name, ctypes.c_size_t) for name in (
+                "PeakWorkingSetSize", "WorkingSetSize", "QuotaPeakPagedPoolUsage", "QuotaPagedPoolUsage",
+                "QuotaPeakNonPagedPoolUsage", "QuotaNonPagedPoolUsage", "PagefileUsage", "PeakPagefileUsage")]
+
+    counters = ProcessMemoryCounters()
+    counters.cb = ctypes.sizeof(counters)
+    process = ctypes.windll.kernel32.GetCurrentProcess()  # type: ignore
+    if not ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):  # type: ignore
+        return None
+    return int(counters.PeakWorkingSetSize)
+
+
+def write_fake_thorium(directory: str):
+    """Write an executable starting `benchmarks.fake_thorium` into `directory` and return its path."""
+    if sys.platform.startswith("win"):
+        path = os.path.join(directory, "thorium.cmd")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(f'@set "PYTHONPATH={REPO_ROOT}"\r\n@"{sys.executable}" -m benchmarks.fake_thorium %*\r\n')
+        return path
+    path = os.path.join(directory, "thorium")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(f'#!/bin/sh\nPYTHONPATH="{REPO_ROOT}" exec "{sys.executable}" -m benchmarks.fake_thorium "$@"\n')
+    os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+    return path
+
+
+def run_once(config: dict[str, Any]):
+    """Fetch copies of the benchmark epubs through one `ReaderSession` and measure it.
+
+    Args:
+        config: _benchmark configuration, as built by `benchmark`_
+
+    Returns:
+        The measurements of the run.
+    """
+    # pylint: disable=import-outside-toplevel
+    from utils.manifest import ManifestIndex, is_fetched
+    from utils.reader import ReaderSession
+    from utils.trace import Tracer
+
+    with tempfile.TemporaryDirectory(prefix="lcp-bench-") as work:
+        epub_paths = []
+        for i, source in enumerate(config["epubs"]):
+            epub_paths.append(os.path.join(work, f"book{i}.epub"))
+            shutil.copyfile(source, epub_paths[-1])
+        # Point the fetcher at the mock reader instead of looking for Thorium Reader
+        fake_thorium = write_fake_thorium(work)
+        os.environ[CONFIG_VARIABLE] = json.dumps({**config["mock"], "instance_file": os.path.join(work, "instance")})
+
+        async def fetch_all():
+            async with ReaderSession(thorium_path=fake_thorium, max_concurrency=config["concurrency"],
+                                     cache_dir=os.path.join(work, "cache"), tracer=tracer) as reader:
+                return [await reader.fetch_epub(epub_path) for epub_path in epub_paths]
+
+        tracer = Tracer()
+        start = time.perf_counter()
+        results = asyncio.run(fetch_all())
+        wall_time = time.perf_counter() - start
+        summary = tracer.summary()
+        stages = {name: stage["duration"] for name, stage in summary["stages"].items()}
+        # Filtering overlaps fetching, so its stage is the time spent filtering summed over all files
+        stages["filter"] = sum(record.get("filter_time", 0.0) for record in summary["resources"].values())
+
+        fetched = [item for epub_path in epub_paths
+                   for item in ManifestIndex.from_epub(epub_path).items.values() if is_fetched(item)]
+        fetched_bytes = sum(item.size for item in fetched)
+        fetch_time = stages.get("fetch") or wall_time
+        return {
+            "wall_time": wall_time,
+            "book_times": [result.elapsed for result in results],
+            "stages": stages,
+            "counters": summary["counters"],
+            "peak_rss": peak_rss(),
+            "files": len(fetched),
+            "bytes": fetched_bytes,
+            "bytes_per_second": fetched_bytes / fetch_time,
+            "files_per_second": len(fetched) / fetch_time,
+            "output_size": sum(os.path.getsize(result.out_epub) for result in results),
+        }
+
+
+# Command lines exiting during startup, and what they measure
+COLD_START_COMMANDS = {
+    "help": ["main.py", "--help"],
+    "missing_epub": ["main.py", "missing.epub"],
+    "import_reader": ["-c", "import utils.reader"],
+    "import_fetcher": ["-c", "import utils.fetch, utils.launcher"],
+}
+
+
+def cold_start(repeat: int):
+    """Time fresh interpreters running `COLD_START_COMMANDS`, `repeat` times each.
+
+    Returns:
+        The min/median/max wall time of every command.
+    """
+    times: dict[str, list[float]] = {name: [] for name in COLD_START_COMMANDS}
+    for _ in range(repeat):
+        for name, command in COLD_START_COMMANDS.items():
+            start = time.perf_counter()
+            subprocess.run([sys.executable, *command], cwd=REPO_ROOT, stdout=subprocess.DEVNULL, check=True)
+            times[name].append(time.perf_counter() - start)
+    return {name: _summarize(values) for name, values in times.items()}
+
+
+def _summarize(values: list[float]):
+    return {"min": min(values), "median": statistics.median(values), "max": max(values)}
+
+
+def benchmark(config: dict[str, Any], repeat: int, verbose: bool = False):
+    """Run the benchmark `repeat` times, every run in a fresh process.
+
+    Args:
+        config: _benchmark configuration: epub paths, mock server and fetcher settings_
+        repeat: _number of runs_
+        verbose: _show the output of the fetcher_
+
+    Returns:
+        The measurements of every run and their min/median/max.
+    """
+    runs: list[dict[str, Any]] = []
+    with tempfile.TemporaryDirectory(prefix="lcp-bench-") as work:
+        config_path = os.path.join(work, "config.json")
+        with open(config_path, "w", encoding="utf-8") as f:
+            json.dump(config, f)
+        for i in range(repeat):
+            result_path = os.path.join(work, f"run{i}.json")
+            subprocess.run([sys.executable, "-m", "benchmarks.run", "--child", config_path, result_path],
+                           cwd=REPO_ROOT, stdout=None if verbose else subprocess.DEVNULL, check=True)
+            with open(result_path, encoding="utf-8") as f:
+                runs.append(json.load(f))
+            print(f"Run {i + 1}/{repeat}: {runs[-1]['wall_time']:.3f}s", file=sys.stderr)
+
+    summary: dict[str, Any] = {
+        key: _summarize([run[key] for run in runs])
+        for key in ("wall_time", "bytes_per_second", "files_per_second")
+    }
+    if all(run["peak_rss"] is not None for run in runs):
+        summary["peak_rss"] = _summarize([run["peak_rss"] for run in runs])
+    stages = sorted({stage for run in runs for stage in run["stages"]})
+    summary["stages"] = {stage: _summarize([run["stages"].get(stage, 0.0) for run in runs]) for stage in stages}
+    # The first book pays for launching the reader, the others show the cost of a book on a running reader
+    summary["book_times"] = [_summarize(list(times)) for times in zip(*(run["book_times"] for run in runs))]
+    return {"runs": runs, "summary": summary}
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description="Benchmark the fetcher offline against a mock Thorium Reader.")
+    parser.add_argument("--chapters", type=int, default=200, help="number of xhtml chapters")
+    parser.add_argument("--chapter-size", type=int, default=16 * 1024, help="approximate chapter size in bytes")
+    parser.add_argument("--images", type=int, default=20, help="number of images")
+    parser.add_argument("--image-size", type=int, default=512 * 1024, help="image size in bytes")
+    parser.add_argument("--layout", choices=sorted(LAYOUTS), default="nested", help="directory layout of the epub")
+    parser.add_argument("--latency", type=float, default=0.002, help="seconds every evaluate reply is delayed by")
+    parser.add_argument("--bandwidth", type=float, default=None, help="bytes per second of the mock reader")
+    parser.add_argument("--reload-every", type=int, default=None,
+                        help="reload the mock reader after this many evaluates, to measure recovery")
+    parser.add_argument("--head-size", type=int, default=4096, help="bytes injected into every xhtml head")
+    parser.add_argument("--books", type=int, default=1, help="number of books fetched through one reader")
+    parser.add_argument("--concurrency", type=int, default=16, help="max_concurrency of the fetcher")
+    parser.add_argument("--repeat", type=int, default=3, help="number of runs")
+    parser.add_argument("--output", help="write the JSON results to this file instead of stdout")
+    parser.add_argument("--verbose", action="store_true", help="show the output of the fetcher")
+    parser.add_argument("--child", nargs=2, metavar=("CONFIG", "RESULT"), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        with open(args.child[0], encoding="utf-8") as f:
+            config = json.load(f)
+        result = run_once(config)
+        with open(args.child[1], "w", encoding="utf-8") as f:
+            json.dump(result, f)
+        return
+
+    with tempfile.TemporaryDirectory(prefix="lcp-bench-") as work:
+        epub_paths = [os.path.join(work, f"book{i}.epub") for i in range(args.books)]
+        epubs = [generate_epub(epub_path, args.chapters, args.chapter_size, args.images, args.image_size,
+                               args.layout, seed=i) for i, epub_path in enumerate(epub_paths)]
+        config = {
+            "epubs": epub_paths,
+            "concurrency": args.concurrency,
+            "mock": {"latency": args.latency, "bandwidth": args.bandwidth, "head_size": args.head_size,
+                     "reload_every": args.reload_every},
+        }
+        results = benchmark(config, args.repeat, args.verbose)
+    results["cold_start"] = cold_start(args.repeat)
+
+    report = {
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "epubs": epubs,
+        "mock": config["mock"],
+        "concurrency": args.concurrency,
+        **results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+"""Generate synthetic LCP-like epubs for the benchmarks.
+
+Usage:
+    python -m benchmarks.synthetic_epub out.epub --chapters 200 --images 20 --image-size 1000000
+"""
+import argparse
+import json
+import posixpath
+import random
+import zipfile
+
+# Directory layouts: where package.opf lives and which folder each kind of resource goes to
+LAYOUTS = {
+    "flat": ("OEBPS", {"chapter": "", "image": "", "style": ""}),
+    "nested": ("OEBPS", {"chapter": "Text/", "image": "Images/", "style": "Styles/"}),
+    "root": ("", {"chapter": "", "image": "", "style": ""}),
+}
+
+# The "encryption" of the synthetic epubs: the first bytes of every encrypted entry are XORed with a key,
+# which is enough to make them unusable while letting the mock reader "decrypt" them again
+SCRAMBLED_PREFIX = 64
+SCRAMBLE_KEY = 0x5A
+
+_WORDS = ("lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor incididunt ut labore et "
+          "dolore magna aliqua ut enim ad minim veniam quis nostrud exercitation ullamco laboris nisi").split()
+
+
+def scramble(data: bytes):
+    """Encrypt or decrypt the content of a synthetic epub entry (the operation is its own inverse)."""
+    head = bytes(b ^ SCRAMBLE_KEY for b in data[:SCRAMBLED_PREFIX])
+    return head + data[SCRAMBLED_PREFIX:]
+
+
+def _chapter(rng: random.Random, title: str, size: int, stylesheet: str, image: str | None):
+    paragraphs: list[str] = []
+    length = 0
+    while length < size:
+        paragraph = " ".join(rng.choice(_WORDS) for _ in range(rng.randint(40, 120)))
+        paragraphs.append(f"    <p>{paragraph}.</p>")
+        length += len(paragraph) + 12
+    if image is not None:
+        paragraphs.insert(len(paragraphs) // 2, f'    <p><img src="{image}" alt="{title}"/></p>')
+    body = "\n".join(paragraphs)
+    return f"""<?xml version="1.0" encoding="utf-8"?>
+<!DOCTYPE html>
+<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops" lang="en">
+<head>
+  <title>{title}</title>
+  <link href="{stylesheet}" rel="stylesheet" type="text/css"/>
+</head>
+<body>
+  <h1>{title}</h1>
+{body}
+</body>
+</html>
+"""
+
+
+def _image(rng: random.Random, size: int):
+    # A JPEG signature around incompressible noise, like real photos
+    return b"\xff\xd8\xff\xe0" + rng.randbytes(max(size - 6, 0)) + b"\xff\xd9"
+
+
+def generate_epub(path: str, chapters: int = 50, chapter_size: int = 16 * 1024, images: int = 10,
+                  image_size: int = 256 * 1024, layout: str = "nested", seed: int = 0):
+    """Write a synthetic epub whose chapters, images and stylesheet are listed as encrypted.
+
+    Args:
+        path: _path the epub is written to_
+        chapters: _number of xhtml chapters_
+        chapter_size: _approximate size of every chapter in bytes_
+        images: _number of jpeg images, spread over the chapters_
+        image_size: _size of every image in bytes_
+        layout: _directory layout, one of LAYOUTS_
+        seed: _seed of the generated content, the same arguments always give the same epub_
+
+    Returns:
+        A summary of the generated epub: its arguments, number of entries and total size of the encrypted entries.
+    """
+    rng = random.Random(seed)
+    opf_dir, folders = LAYOUTS[layout]
+    opf_path = posixpath.join(opf_dir, "content.opf")
+
+    # (manifest id, href relative to package.opf, media type, content, encrypted)
+    items: list[tuple[str, str, str, bytes, bool]] = []
+    style_href = folders["style"] + "style.css"
+    items.append(("style", style_href, "text/css",
+                  b"body { font-family: serif; line-height: 1.4; }\nh1 { text-align: center; }\n" * 8, True))
+    image_hrefs = [f"{folders['image']}image{i + 1:04}.jpg" for i in range(images)]
+    for i, href in enumerate(image_hrefs):
+        items.append((f"image{i + 1}", href, "image/jpeg", _image(rng, image_size), True))
+    for i in range(chapters):
+        chapter_href = f"{folders['chapter']}chapter{i + 1:04}.xhtml"
+
+        def relative(href: str):
+            return posixpath.relpath(href, posixpath.dirname(chapter_href) or ".")
+        image = None
+        if images and i % max(chapters // images, 1) == 0:
+            image = relative(image_hrefs[i * images // chapters])
+        content = _chapter(rng, f"Chapter {i + 1}", chapter_size, relative(style_href), image)
+        items.append((f"chapter{i + 1}", chapter_href, "application/xhtml+xml", content.encode("utf-8"), True))
+    nav_links = "".join(f'<li><a href="{posixpath.relpath(href, folders["chapter"] or ".")}">{item_id}</a></li>'
+                        for item_id, href, media_type, _, _ in items if media_type == "application/xhtml+xml")
+    nav = (f'<?xml version="1.0" encoding="utf-8"?>\n<html xmlns="http://www.w3.org/1999/xhtml" '
+           f'xmlns:epub="http://www.idpf.org/2007/ops"><head><title>Contents</title></head><body>'
+           f'<nav epub:type="toc"><ol>{nav_links}</ol></nav></body></html>')
+    items.append(("nav", folders["chapter"] + "nav.xhtml", "application/xhtml+xml", nav.encode("utf-8"), False))
+
+    nav_properties = ' properties="nav"'
+    manifest = "\n    ".join(
+        f'<item id="{item_id}" href="{href}" media-type="{media_type}"{nav_properties if item_id == "nav" else ""}/>'
+        for item_id, href, media_type, _, _ in items)
+    spine = "\n    ".join(f'<itemref idref="{item_id}"/>' for item_id, _, media_type, _, _ in items
+                          if media_type == "application/xhtml+xml" and item_id != "nav")
+    opf = f"""<?xml version="1.0" encoding="utf-8"?>
+<package xmlns="http://www.idpf.org/2007/opf" version="3.0" unique-identifier="uid">
+  <metadata xmlns:dc="http://purl.org/dc/elements/1.1/">
+    <dc:identifier id="uid">urn:uuid:00000000-0000-4000-8000-{seed:012}</dc:identifier>
+    <dc:title>Synthetic benchmark book</dc:title>
+    <dc:language>en</dc:language>
+  </metadata>
+  <manifest>
+    {manifest}
+  </manifest>
+  <spine>
+    {spine}
+  </spine>
+</package>
+"""
+    container = f"""<?xml version="1.0" encoding="utf-8"?>
+<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">
+  <rootfiles><rootfile full-path="{opf_path}" media-type="application/oebps-package+xml"/></rootfiles>
+</container>
+"""
+    references = "\n".join(
+        f'  <EncryptedData xmlns="http://www.w3.org/2001/04/xmlenc#"><CipherData>'
+        f'<CipherReference URI="{posixpath.join(opf_dir, href)}"/></CipherData></EncryptedData>'
+        for _, href, _, _, encrypted in items if encrypted)
+    encryption = (f'<?xml version="1.0" encoding="utf-8"?>\n'
+                  f'<encryption xmlns="urn:oasis:names:tc:opendocument:xmlns:container">\n'
+                  f'{references}\n</encryption>\n')
+
+    encrypted_size = 0
+    with zipfile.ZipFile(path, 'w') as zf:
+        zf.writestr("mimetype", "application/epub+zip", compress_type=zipfile.ZIP_STORED)
+        zf.writestr("META-INF/container.xml", container, compress_type=zipfile.ZIP_DEFLATED)
+        zf.writestr("META-INF/encryption.xml", encryption, compress_type=zipfile.ZIP_DEFLATED)
+        zf.writestr("META-INF/license.lcpl", json.dumps({"id": f"synthetic-{seed}"}),
+                    compress_type=zipfile.ZIP_DEFLATED)
+        zf.writestr(opf_path, opf, compress_type=zipfile.ZIP_DEFLATED)
+        for _, href, media_type, content, encrypted in items:
+            if encrypted:
+                encrypted_size += len(content)
+                content = scramble(content)
+            compress_type = zipfile.ZIP_STORED if media_type.startswith("image/") else zipfile.ZIP_DEFLATED
+            zf.writestr(posixpath.join(opf_dir, href), content, compress_type=compress_type)
+
+    return {
+        "chapters": chapters,
+        "chapter_size": chapter_size,
+        "images": images,
+        "image_size": image_size,
+        "layout": layout,
+        "seed": seed,
+        "entries": len(items) + 5,
+        "encrypted_entries": sum(1 for item in items if item[4]),
+        "encrypted_bytes": encrypted_size,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic LCP-like epub for the benchmarks.")
+    parser.add_argument("path", help="path the epub is written to")
+    parser.add_argument("--chapters", type=int, default=50)
+    parser.add_argument("--chapter-size", type=int, default=16 * 1024)
+    parser.add_argument("--images", type=int, default=10)
+    parser.add_argument("--image-size", type=int, default=256 * 1024)
+    parser.add_argument("--layout", choices=sorted(LAYOUTS), default="nested")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    print(json.dumps(generate_epub(args.path, args.chapters, args.chapter_size, args.images, args.image_size,
+                                   args.layout, args.seed), indent=2))
@@ -1,210 +1,148 @@
-import asyncio
+import argparse
 import os
-import subprocess
-import sys
-import threading
-import time
 import xml.etree.ElementTree as ET
 import zipfile
 
-import requests
-from bs4 import BeautifulSoup
+from utils import default_output_path
+from utils.manifest import ManifestIndex
+from utils.trace import NULL_TRACER, TRACE_FORMATS, Tracer
 
-from utils import find_thorium_path
-from utils.fetch import fetch_file
-from utils.get_path import get_base_path
-from utils.hide_windows import monitor_and_hide_program_by_pid
+# Only the modules needed to check the input are imported up front, the fetcher itself
+# (asyncio, websockets, the worker pools) is imported once there is something to fetch.
 
 
-async def main(epub_path: str):
-    """Main function to fetch content from an epub file using Thorium Reader's remote debugging interface.
+def load_epub(epub_path: str):
+    """Check that an epub can be fetched and load its manifest, asking before an existing output file is replaced.
 
-    Args:
-        epub_path: _path to the epub file to fetch content from_
+    Returns:
+        The output path and manifest index of the epub, or None if it should be skipped.
     """
-
     # 0. Check if the epub file exists and if there alraedy is a _fetched.epub file
     if not os.path.exists(epub_path):
         print(f"Error: The file {epub_path} does not exist.")
-        return
+        return None
     if epub_path.endswith("_fetched.epub"):
         print(f"Error: The file {epub_path} already seems to be fetched. Please provide a different epub file.")
-        return
+        return None
     if not epub_path.endswith(".epub"):
         print(f"Error: The file {epub_path} is not a valid epub file.")
-        return
-    out_epub = os.path.splitext(epub_path)[0] + "_fetched.epub"
+        return None
+    try:
+        index = ManifestIndex.from_epub(epub_path)
+    except (zipfile.BadZipFile, KeyError, AssertionError, ET.ParseError) as e:
+        print(f"Error: The file {epub_path} is not a valid epub file: {e}")
+        return None
+    out_epub = default_output_path(epub_path)
     if os.path.exists(out_epub):
         response = input(f"The file {out_epub} already exists. Do you want to replace it? (y/N): ").strip().lower()
         if response != 'y':
             print("Operation cancelled.")
-            return
-
-    # 0.5 Check if Thorium Reader is already running, if so, ask to close it
-    thorium_path = find_thorium_path()
-    for proc in subprocess.run(['tasklist'], capture_output=True, text=True).stdout.splitlines():
-        if os.path.basename(thorium_path).lower() in proc.lower():
-            response = input(
-                "Thorium Reader is already running. Please close it and then press enter to continue. To cancel type 'exit' and press enter").strip().lower()
-            if response == 'exit':
-                print("Operation cancelled.")
-                return
-            break
-
-    # 1. Launch Thorium Reader with debug args
-    proc = subprocess.Popen(
-        [
-            thorium_path,
-            epub_path,
-            "--remote-debugging-port=9223",
-            "--remote-allow-origins=*",
-        ],
-        stdout=subprocess.DEVNULL,
-        stderr=subprocess.DEVNULL,
-    )
-
-    # Start the monitor thread
-    # This thread will hide any Thorium Reader window if it becomes visible
-    stop_event = threading.Event()
-    monitor_thread = threading.Thread(target=monitor_and_hide_program_by_pid, args=(proc.pid, stop_event))
-    monitor_thread.start()
+            return None
+    return out_epub, index
 
-    try:
-        # 2. Wait for debugger to be ready
-        for _ in range(30):
+
+def load_epubs(epub_paths: list[str]):
+    """Check every epub with `load_epub`, before anything is launched.
+
+    Returns:
+        The (epub path, output path, manifest index) of every epub to fetch, as taken by `fetch_books`.
+    """
+    return [(epub_path, *loaded) for epub_path in epub_paths if (loaded := load_epub(epub_path))]
+
+
+def confirm_launch():
+    """Ask to close the running Thorium Reader, return False if the user cancels."""
+    response = input(
+        "Thorium Reader is already running. Please close it and then press enter to continue. To cancel type 'exit' and press enter").strip().lower()
+    return response != 'exit'
+
+
+async def main(*epub_paths: str, max_concurrency: int = 16, cache_dir: str | None = None,
+               tracer: Tracer = NULL_TRACER):
+    """Main function to fetch content from epub files using Thorium Reader's remote debugging interface.
+
+    All books are fetched through a single Thorium Reader instance, launched for the first book that has
+    files missing from the fetch cache. A fully cached book is repackaged without launching it at all.
+
+    Args:
+        epub_paths: _paths to the epub files to fetch content from_
+        max_concurrency: _maximum number of resources fetched at the same time_
+        cache_dir: _directory of the fetch cache, defaults to `utils.cache.default_cache_dir()`_
+        tracer: _tracer recording the stages of the run and every fetched resource_
+    """
+    await fetch_books(load_epubs(list(epub_paths)), max_concurrency, cache_dir, tracer=tracer)
+
+
+async def fetch_books(books: list[tuple[str, str, ManifestIndex]], max_concurrency: int = 16,
+                      cache_dir: str | None = None, hide_windows: bool = True, verify: bool = True,
+                      tracer: Tracer = NULL_TRACER):
+    """Fetch and repackage books checked by `load_epub`.
+
+    Args:
+        books: _(epub path, output path, manifest index) of every book_
+        max_concurrency: _maximum number of resources fetched at the same time_
+        cache_dir: _directory of the fetch cache, defaults to `utils.cache.default_cache_dir()`_
+        hide_windows: _hide the windows of Thorium Reader (Windows only)_
+        verify: _check every repackaged epub for damaged or still encrypted files_
+        tracer: _tracer recording the stages of the run and every fetched resource_
+    """
+    # pylint: disable=import-outside-toplevel
+    from utils.reader import ReaderSession, ReaderUnavailableError
+    from utils.verify import print_report
+
+    async with ReaderSession(max_concurrency=max_concurrency, cache_dir=cache_dir, confirm_launch=confirm_launch,
+                             progress=True, hide_windows=hide_windows, verify=verify, tracer=tracer) as reader:
+        for epub_path, out_epub, index in books:
+            print(f"Repackaging {epub_path} with fetched content...")
             try:
-                resp = requests.get("http://localhost:9223/json", timeout=5)
-                if resp.ok:
-                    if len(resp.json()) == 3:
-                        break
-                    else:
-                        print("Waiting for Thorium remote debugger to be ready...")
-                        time.sleep(1)
-            except (requests.ConnectionError, requests.Timeout):
-                time.sleep(1)
-        else:
-            print("Could not connect to Thorium remote debugger.")
-            return
-
-        print("Thorium Reader is ready for remote debugging.")
-
-        # Stop the monitor thread
-        stop_event.set()
-        monitor_thread.join()
-
-        # 3. Find webSocketDebuggerUrl
-        targets = resp.json()
-        ws_url = None
-        for t in targets:
-            if t.get("parentId", "") != "":
-                # Look for a target with a parentId, which is likely the main page
-                ws_url = t.get("webSocketDebuggerUrl")
-                break
-        if not ws_url:
-            ws_url = targets[0].get("webSocketDebuggerUrl")
-        if not ws_url:
-            print("Could not find webSocketDebuggerUrl.")
-            return
-
-        # 4. Extract package.opf from epub
-        with zipfile.ZipFile(epub_path, 'r') as zf:
-            opf_path = None
-            # Find the path to package.opf from META-INF/container.xml
-            with zf.open("META-INF/container.xml") as f:
-                tree = ET.parse(f)
-                rootfile = tree.find(".//{*}rootfile")
-                assert rootfile is not None, "No rootfile found in container.xml"
-                opf_path = rootfile.attrib['full-path']
-            with zf.open(opf_path) as f:
-                opf_xml = f.read()
-            tree = ET.fromstring(opf_xml)
-            ns = {'opf': 'http://www.idpf.org/2007/opf'}
-            manifest = tree.find('.//opf:manifest', ns)
-            assert manifest is not None, "No manifest found in package.opf"
-            file_list = [(item.attrib['media-type'], item.attrib['href']) for item in manifest.findall('opf:item', ns)]
-
-        # 5. Fetch each file using get_content_via_evaluate, with progress (parallelized)
-        resource_url = await get_base_path(ws_url)
-        assert resource_url is not None, "Could not get base path from Thorium Reader"
-        base_dir = resource_url + os.path.dirname(opf_path)
-        fetched_files: dict[str, str | bytes] = {}
-        total_files = len(file_list)
-
-        print(f"Fetching {total_files-1} files from epub...")  # Exclude nav.xhtml
-
-        tasks = [
-            fetch_file(base_dir, ws_url, file_type, file)
-            for _, (file_type, file) in enumerate(file_list, 1)
-        ]
-        results = await asyncio.gather(*tasks)
-        for filename, content in results:
-            if filename and content:
-                fetched_files[filename] = content
-        print(f"Fetched {len(fetched_files)} files.")
-
-        # 6. Filter the fetched files
-        # the fetched xhtml files contains a bunch of javascript/css that is not needed
-        # in the HEAD section we only need the title and the link to the css file, and meta tags
-        print("Filtering fetched files...")
-        for filename, content in fetched_files.items():
-            if filename.endswith(".xhtml"):
-                # Filter the content to keep only the title, link to css, and meta tags
-                soup = BeautifulSoup(content, 'html.parser')
-                head = soup.head
-                if head:
-                    # Keep only title and link tags
-                    title = head.find('title')
-                    links = head.find_all('link', rel='stylesheet')
-                    metas = head.find_all('meta')
-                    new_head = soup.new_tag('head')  # type: ignore
-                    if title:
-                        new_head.append(title)
-                    for link in links:
-                        # Skip Thorium/Readium specific styles
-                        if "thorium" in link.get('href', '') or "readium" in link.get('href', ''):
-                            continue
-                        new_head.append(link)
-                    for meta in metas:
-                        new_head.append(meta)
-                    head.replace_with(new_head)
-                # Remove readium-related attributes from the html tag
-                html_tag = soup.find('html')
-                if html_tag:
-                    attrs_to_remove: list[str] = [
-                        attr for attr in html_tag.attrs if 'readium' in attr.lower()]  # type: ignore
-                    for attr in attrs_to_remove:
-                        del html_tag[attr]  # type: ignore
-                fetched_files[filename] = str(soup)
-
-        # 7. Repackage into new epub
-        print("Repackaging epub with fetched content...")
-        out_epub = os.path.splitext(epub_path)[0] + "_fetched.epub"
-        if os.path.exists(out_epub):
-            os.remove(out_epub)  # Remove existing file if it exists
-
-        with zipfile.ZipFile(out_epub, 'w') as out_zf:
-            # Write mimetype first, uncompressed
-            with zipfile.ZipFile(epub_path, 'r') as zf:
-                out_zf.writestr("mimetype", zf.read("mimetype"), compress_type=zipfile.ZIP_STORED)
-            # Write all other files, replacing with fetched if available
-            with zipfile.ZipFile(epub_path, 'r') as zf:
-                for item in zf.infolist():
-                    filename = item.filename.split("/")[-1]
-                    if filename == "mimetype" or filename == "encryption.xml" or filename == "license.lcpl":
-                        continue
-                    data = fetched_files.get(filename)
-                    if data is None:
-                        # continue  # Skip if no fetched content
-                        data = zf.read(item.filename)
-                    out_zf.writestr(item, data)
-        print(f"Repackaged epub written to {out_epub}")
-
-    finally:
-        proc.terminate()
+                result = await reader.fetch_epub(epub_path, out_epub, index)
+            except ReaderUnavailableError:
+                print("Operation cancelled.")
+                return
+            except (TimeoutError, RuntimeError) as e:
+                print(f"Could not connect to Thorium remote debugger: {e}")
+                return
+            if result.from_cache:
+                print(f"Reused {len(result.from_cache)} files fetched by a previous run.")
+            if result.failed:
+                print(f"Could not fetch {len(result.failed)} files, keeping their original content: "
+                      f"{', '.join(result.failed)}")
+            print(f"Fetched {len(result.fetched)} files.")
+            print(f"Repackaged epub written to {result.out_epub}")
+            if result.verification is not None:
+                print_report(result.verification)
+                if result.verification.refetch:
+                    print(f"Run again to fetch {len(result.verification.refetch)} files again: "
+                          f"{', '.join(item.href for item in result.verification.refetch)}")
 
 
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("Usage: python main.py <epub_path>")
-        sys.exit(1)
-    asyncio.run(main(sys.argv[1]))
+    parser = argparse.ArgumentParser(
+        description="Fetch the decrypted content of LCP-protected epubs from Thorium Reader.")
+    parser.add_argument("epub_paths", nargs="+", metavar="epub_path", help="path to an epub file to fetch content from")
+    parser.add_argument("--trace", metavar="PATH",
+                        help="write a trace of the run (stages, resources, counters) to PATH")
+    parser.add_argument("--trace-format", choices=TRACE_FORMATS, default="chrome",
+                        help="chrome: Chrome trace event format, json: plain summary (default: chrome)")
+    parser.add_argument("--show-windows", action="store_true",
+                        help="show the windows of Thorium Reader instead of hiding them (Windows only)")
+    parser.add_argument("--no-verify", action="store_true",
+                        help="do not check the repackaged epubs for damaged or still encrypted files")
+    args = parser.parse_args()
+    # Check every book before anything else is imported or launched
+    valid_books = load_epubs(args.epub_paths)
+    if valid_books:
+        import asyncio
+        import logging
+
+        # The fetcher reports retries, page errors and damaged cache entries through logging
+        logging.basicConfig(format="%(message)s", level=logging.INFO)
+
+        run_tracer = Tracer() if args.trace else NULL_TRACER
+        try:
+            asyncio.run(fetch_books(valid_books, hide_windows=not args.show_windows, verify=not args.no_verify,
+                                    tracer=run_tracer))
+        finally:
+            if args.trace:
+                run_tracer.write(args.trace, args.trace_format)
+                print(f"Trace written to {args.trace}")
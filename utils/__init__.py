@@ -49,3 +49,8 @@ def find_thorium_path():
     if os.path.isfile(user_path):
         return user_path
     raise FileNotFoundError("Thorium Reader executable not found.")
+
+
+def default_output_path(epub_path: str):
+    """Path the repackaged epub is written to by default: the source path with "_fetched" appended."""
+    return os.path.splitext(epub_path)[0] + "_fetched.epub"
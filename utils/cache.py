@@ -0,0 +1,177 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from utils.repackage import COPY_CHUNK_SIZE, Payload
+
+# Default upper bound for the total size of the cached resources
+DEFAULT_MAX_SIZE = 2 * 1024 * 1024 * 1024
+
+logger = logging.getLogger(__name__)
+
+
+def default_cache_dir():
+    """Per-user directory the fetch cache is kept in."""
+    if sys.platform.startswith("win"):
+        base = os.environ.get("LOCALAPPDATA") or os.path.expanduser("~")
+    else:
+        base = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(base, "lcp-epub-fetcher")
+
+
+def book_id(epub_path: str):
+    """Content hash of a source epub, identifying its cached resources across runs and file names."""
+    digest = hashlib.sha256()
+    with open(epub_path, 'rb') as f:
+        while chunk := f.read(COPY_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class FetchCache:
+    """Content-addressed on-disk cache of fetched resources.
+
+    Entries are keyed by a hash of the source epub and the manifest href, and hold the raw fetched
+    bytes next to a JSON metadata file with their size and SHA-256, which is checked on every read.
+    Reads refresh an entry's modification time, and `evict` removes the least recently used entries
+    until the cache fits in `max_size`.
+
+    Usage:
+        cache = FetchCache()
+        book = book_id(epub_path)
+        cache.put(book, "chapter1.xhtml", content)
+        content = cache.get(book, "chapter1.xhtml")
+    """
+
+    def __init__(self, directory: str | None = None, max_size: int = DEFAULT_MAX_SIZE):
+        """
+        Args:
+            directory: _directory the cache is kept in, defaults to `default_cache_dir()`_
+            max_size: _maximum total size of the cached resources in bytes_
+        """
+        self.directory = directory or default_cache_dir()
+        self.max_size = max_size
+
+    def contains(self, book: str, href: str):
+        """Whether an entry exists for a resource, without checking its integrity."""
+        return os.path.exists(self._paths(book, href)[1])
+
+    def get(self, book: str, href: str) -> Payload | None:
+        """Read a cached resource.
+
+        Args:
+            book: _`book_id` of the source epub_
+            href: _manifest href of the resource_
+
+        Returns:
+            The content as bytes if it was delivered in memory, or an open binary file if it was spilled to disk.
+            None if the resource is not cached or its entry is damaged, damaged entries are removed.
+        """
+        blob_path, meta_path = self._paths(book, href)
+        try:
+            with open(meta_path, encoding="utf-8") as f:
+                meta = json.load(f)
+            blob = open(blob_path, 'rb')
+        except (OSError, ValueError):
+            return None
+        digest = hashlib.sha256()
+        size = 0
+        while chunk := blob.read(COPY_CHUNK_SIZE):
+            digest.update(chunk)
+            size += len(chunk)
+        if size != meta.get("size") or digest.hexdigest() != meta.get("sha256"):
+            blob.close()
+            logger.warning("Cached copy of %s is damaged, fetching it again.", href)
+            self._remove(blob_path, meta_path)
+            return None
+        os.utime(meta_path)  # Most recently used
+        blob.seek(0)
+        if meta.get("inline", meta.get("text")):
+            with blob:
+                return blob.read()
+        return blob
+
+    def put(self, book: str, href: str, content: Payload):
+        """Store a fetched resource, replacing any previous entry.
+
+        Args:
+            book: _`book_id` of the source epub_
+            href: _manifest href of the resource_
+            content: _fetched content, file contents are copied and the file is rewound afterwards_
+        """
+        blob_path, meta_path = self._paths(book, href)
+        os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+        digest = hashlib.sha256()
+        size = 0
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(blob_path), delete=False) as tmp:
+            if isinstance(content, (str, bytes, bytearray)):
+                data = content.encode("utf-8") if isinstance(content, str) else content
+                tmp.write(data)
+                digest.update(data)
+                size = len(data)
+            else:
+                content.seek(0)
+                while chunk := content.read(COPY_CHUNK_SIZE):
+                    tmp.write(chunk)
+                    digest.update(chunk)
+                    size += len(chunk)
+                content.seek(0)
+        os.replace(tmp.name, blob_path)
+        meta = {
+            "href": href,
+            "size": size,
+            "sha256": digest.hexdigest(),
+            "inline": isinstance(content, (str, bytes, bytearray)),
+            "stored": time.time(),
+        }
+        with open(meta_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+
+    def evict(self):
+        """Remove the least recently used entries until the cache fits in `max_size`."""
+        entries: list[tuple[float, int, str, str]] = []
+        total = 0
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if not name.endswith(".json"):
+                    continue
+                meta_path = os.path.join(root, name)
+                blob_path = meta_path[:-len(".json")]
+                try:
+                    size = os.path.getsize(blob_path)
+                    used = os.path.getmtime(meta_path)
+                except OSError:
+                    continue
+                entries.append((used, size, blob_path, meta_path))
+                total += size
+        for _, size, blob_path, meta_path in sorted(entries):
+            if total <= self.max_size:
+                break
+            self._remove(blob_path, meta_path)
+            total -= size
+
+    def discard(self, book: str, href: str):
+        """Remove the entry of a resource, so it is fetched again."""
+        self._remove(*self._paths(book, href))
+
+    def clear(self):
+        """Remove every cached resource."""
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def _paths(self, book: str, href: str):
+        key = hashlib.sha256(f"{book}\0{href}".encode("utf-8")).hexdigest()
+        blob_path = os.path.join(self.directory, book[:16], key)
+        return blob_path, blob_path + ".json"
+
+    @staticmethod
+    def _remove(*paths: str):
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
@@ -0,0 +1,116 @@
+import asyncio
+from typing import Any
+
+from utils.devtools import DevToolsSession
+from utils.get_path import READER_URL_SUBSTRING, base_path_from_url, find_matching_frames
+
+
+class ReaderContext:
+    """Follows the JavaScript execution context of the reader frame of a Thorium Reader target.
+
+    Execution contexts are announced with Runtime.executionContextCreated events as soon as the
+    Runtime domain is enabled, and the default context whose origin is served by Thorium is kept
+    as the reader's. Expressions evaluated with its id run in the reader frame, whatever frame the
+    target's default context belongs to. When the context goes away (the reader reloads), `wait`
+    blocks until its replacement is announced, so fetches retried by the scheduler pick it up.
+
+    Usage:
+        context = ReaderContext(session)
+        base_url = await context.start()
+        await session.send("Runtime.evaluate", {"expression": ..., "contextId": await context.wait()})
+    """
+
+    def __init__(self, session: DevToolsSession, timeout: float = 10.0):
+        """
+        Args:
+            session: _DevTools session connected to the Thorium Reader target_
+            timeout: _seconds `start` waits for the reader context to be announced_
+        """
+        self.session = session
+        self.timeout = timeout
+        self.context_id: int | None = None
+        self.base_url: str | None = None
+        self.lost = 0  # Number of times the reader context went away
+        self._contexts: dict[int, dict[str, Any]] = {}
+        self._frame_id: str | None = None  # Reader frame found in the frame tree, if origins did not match
+        self._found = asyncio.Event()
+
+    async def start(self):
+        """Enable the Runtime domain, find the reader context and read the publication URL in it.
+
+        Returns:
+            The base path the publication is served from, see `utils.get_path.base_path_from_url`.
+
+        Raises:
+            TimeoutError: If no reader context is announced within the timeout.
+            RuntimeError: If the reader frame is not showing a publication.
+        """
+        self.session.add_listener("Runtime.executionContextCreated", self._on_created)
+        self.session.add_listener("Runtime.executionContextDestroyed", self._on_destroyed)
+        self.session.add_listener("Runtime.executionContextsCleared", self._on_cleared)
+        # Existing contexts are announced before the reply to Runtime.enable
+        await self.session.enable("Runtime")
+        if self.context_id is None:
+            # Origins of custom schemes are opaque in some Electron versions, find the frame by its URL instead
+            frames = await find_matching_frames(self.session, READER_URL_SUBSTRING)
+            if frames:
+                self._frame_id = frames[0]["id"]
+                for context in self._contexts.values():
+                    self._consider(context)
+        try:
+            await asyncio.wait_for(self._found.wait(), self.timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError("The reader frame has no execution context") from None
+
+        href = await self.evaluate("location.href")
+        self.base_url = base_path_from_url(href) if isinstance(href, str) else None
+        if self.base_url is None:
+            raise RuntimeError(f"The reader frame is not showing a publication: {href}")
+        return self.base_url
+
+    async def wait(self):
+        """The id of the reader context, waiting for a new one while it is gone."""
+        while self.context_id is None:
+            self._found.clear()
+            await self._found.wait()
+        return self.context_id
+
+    async def evaluate(self, expression: str):
+        """Evaluate a synchronous expression in the reader context and return its value, None on errors."""
+        data = await self.session.send("Runtime.evaluate", {
+            "expression": expression,
+            "contextId": await self.wait(),
+            "returnByValue": True,
+        })
+        if "error" in data or "exceptionDetails" in data.get("result", {}):
+            return None
+        return data["result"]["result"].get("value")
+
+    def _on_created(self, params: dict[str, Any]):
+        context = params["context"]
+        self._contexts[context["id"]] = context
+        self._consider(context)
+
+    def _consider(self, context: dict[str, Any]):
+        aux_data = context.get("auxData", {})
+        if not aux_data.get("isDefault", True):
+            return  # Isolated worlds of extensions and preload scripts
+        if context.get("origin", "").startswith(READER_URL_SUBSTRING) or (
+                self._frame_id is not None and aux_data.get("frameId") == self._frame_id):
+            self.context_id = context["id"]
+            self._found.set()
+
+    def _on_destroyed(self, params: dict[str, Any]):
+        self._contexts.pop(params["executionContextId"], None)
+        if params["executionContextId"] == self.context_id:
+            self._lose()
+
+    def _on_cleared(self, params: dict[str, Any]):
+        self._contexts.clear()
+        if self.context_id is not None:
+            self._lose()
+
+    def _lose(self):
+        self.context_id = None
+        self.lost += 1
+        self._found.clear()
@@ -0,0 +1,144 @@
+import asyncio
+import itertools
+import json
+import time
+from typing import Any, Callable
+
+import websockets
+
+
+class DevToolsSession:
+    """A single multiplexed connection to a Chrome DevTools Protocol target.
+
+    Every command gets a unique message id and a future; a background reader task
+    matches replies to their futures, so any number of coroutines can share the
+    connection concurrently. Protocol domains are enabled at most once per session, protocol
+    events are passed to the listeners registered with `add_listener`, and the round trip time
+    of every command to those registered with `add_round_trip_listener`.
+    Messages are counted in `sent` (commands by method) and `received` (replies and events by name).
+
+    Usage:
+        async with DevToolsSession(ws_url) as session:
+            response = await session.send("Runtime.evaluate", {...})
+    """
+
+    def __init__(self, devtools_ws_url: str):
+        self.devtools_ws_url = devtools_ws_url
+        self._websocket: Any = None
+        self._reader_task: asyncio.Task[None] | None = None
+        self._ids = itertools.count(1)
+        self._pending: dict[int, asyncio.Future[dict[str, Any]]] = {}
+        self._enabled: dict[str, asyncio.Future[dict[str, Any]]] = {}
+        self._listeners: dict[str, list[Callable[[dict[str, Any]], None]]] = {}
+        self._round_trip_listeners: list[Callable[[str, float], None]] = []
+        self.sent: dict[str, int] = {}
+        self.received: dict[str, int] = {}
+        self.bytes_received = 0
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *exc_info: object):
+        await self.close()
+
+    async def connect(self):
+        """Open the websocket connection and start dispatching replies."""
+        # Resources are returned inline as JSON, so lift the default 1 MiB message limit
+        self._websocket = await websockets.connect(self.devtools_ws_url, max_size=None)
+        self._reader_task = asyncio.create_task(self._read_messages())
+
+    async def close(self):
+        """Close the connection and fail any command still waiting for a reply."""
+        if self._websocket is not None:
+            await self._websocket.close()
+        if self._reader_task is not None:
+            await self._reader_task
+        self._websocket = None
+        self._reader_task = None
+
+    async def send(self, method: str, params: dict[str, Any] | None = None) -> dict[str, Any]:
+        """Send a protocol command and wait for its reply.
+
+        Args:
+            method: _name of the protocol method, e.g. "Runtime.evaluate"_
+            params: _parameters of the method, if any_
+
+        Returns:
+            The full reply message, containing either a "result" or an "error" key.
+        """
+        if self._websocket is None:
+            raise ConnectionError("DevTools session is not connected")
+        message_id = next(self._ids)
+        message: dict[str, Any] = {"id": message_id, "method": method}
+        if params is not None:
+            message["params"] = params
+        future: asyncio.Future[dict[str, Any]] = asyncio.get_running_loop().create_future()
+        self._pending[message_id] = future
+        self.sent[method] = self.sent.get(method, 0) + 1
+        try:
+            started = time.monotonic()
+            await self._websocket.send(json.dumps(message))
+            reply = await future
+            for callback in list(self._round_trip_listeners):
+                callback(method, time.monotonic() - started)
+            return reply
+        finally:
+            self._pending.pop(message_id, None)
+
+    async def enable(self, domain: str) -> dict[str, Any]:
+        """Enable a protocol domain (e.g. "Runtime" or "Page") once for this session.
+
+        Concurrent callers share the same enable command and its reply.
+
+        Args:
+            domain: _name of the protocol domain to enable_
+
+        Returns:
+            The reply to the "<domain>.enable" command.
+        """
+        if domain not in self._enabled:
+            self._enabled[domain] = asyncio.ensure_future(self.send(f"{domain}.enable"))
+        return await asyncio.shield(self._enabled[domain])
+
+    def add_listener(self, event: str, callback: Callable[[dict[str, Any]], None]):
+        """Call `callback` with the params of every `event` (e.g. "Target.targetCreated") received.
+
+        Args:
+            event: _name of the protocol event_
+            callback: _function called from the reader task with the event params_
+        """
+        self._listeners.setdefault(event, []).append(callback)
+
+    def add_round_trip_listener(self, callback: Callable[[str, float], None]):
+        """Call `callback` with the method and the round trip time in seconds of every command that gets a reply.
+
+        Args:
+            callback: _function called with the method name and the seconds from sending the command to its reply_
+        """
+        self._round_trip_listeners.append(callback)
+
+    def remove_listener(self, event: str, callback: Callable[[dict[str, Any]], None]):
+        """Stop calling a callback registered with `add_listener`."""
+        self._listeners.get(event, []).remove(callback)
+
+    async def _read_messages(self):
+        try:
+            async for message in self._websocket:
+                self.bytes_received += len(message)
+                data = json.loads(message)
+                kind = "reply" if "id" in data else data.get("method", "event")
+                self.received[kind] = self.received.get(kind, 0) + 1
+                if "id" not in data:
+                    for callback in list(self._listeners.get(data.get("method"), [])):
+                        callback(data.get("params", {}))
+                    continue
+                future = self._pending.get(data["id"])
+                if future is not None and not future.done():
+                    future.set_result(data)
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            for future in self._pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionError("DevTools connection closed"))
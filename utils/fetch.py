@@ -1,214 +1,437 @@
 import base64
 import json
-import os
+import logging
+import tempfile
+import time
+from contextlib import aclosing
+from functools import partial
+from typing import Any, Awaitable, BinaryIO, Callable, TypeVar
 
-import websockets
+from utils.context import ReaderContext
+from utils.devtools import DevToolsSession
+from utils.manifest import ManifestItem
+from utils.repackage import Payload, payload_size
+from utils.scheduler import AdaptiveScheduler
+from utils.trace import NULL_TRACER, Tracer
 
+T = TypeVar("T")
+Deliver = Callable[[ManifestItem, Payload], Awaitable[None]]
+# Manifest items and contents of the files fetched by one job
+Fetched = list[tuple[ManifestItem, Payload]]
 
-async def get_content_via_evaluate(devtools_ws_url: str, resource_url: str):
+logger = logging.getLogger(__name__)
+
+# Maximum number of bytes of a binary resource transferred per Runtime.evaluate call
+CHUNK_SIZE = 1024 * 1024
+# Binary resources larger than this are streamed to a temporary file instead of being held in memory
+SPILL_SIZE = 4 * 1024 * 1024
+
+# Budget for the combined size of the text resources fetched in one batch, counted as base64 as they are sent,
+# keeping every reply far below the DevTools message size limit
+BATCH_BYTE_BUDGET = 4 * 1024 * 1024
+# Maximum number of text resources fetched in one batch
+BATCH_MAX_ITEMS = 64
+
+# Page-side helper, installed on first use in every execution context.
+# Binary resources are kept in `buffers` while Python reads them chunk by chunk.
+# Text resources are returned as base64 too, so their bytes arrive unchanged and are decoded only where needed
+# (see `utils.filter`). DevTools escapes every character outside printable ASCII in its JSON replies, so
+# base64's third more is far cheaper than a one char per byte string of non-ASCII text.
+PAGE_FETCHER_JS = """{
+    buffers: new Map(),
+    nextHandle: 1,
+    binary(bytes) {
+        let binary = '';
+        for (let i = 0; i < bytes.length; i += 0x8000) {
+            binary += String.fromCharCode.apply(null, bytes.subarray(i, i + 0x8000));
+        }
+        return binary;
+    },
+    encode(bytes) {
+        return btoa(this.binary(bytes));
+    },
+    async open(url, chunkSize) {
+        try {
+            const response = await fetch(url);
+            if (!response.ok) {
+                return { error: `Fetch failed: ${response.status} ${response.statusText}` };
+            }
+            const bytes = new Uint8Array(await response.arrayBuffer());
+            const result = { success: true, size: bytes.length, base64: this.encode(bytes.subarray(0, chunkSize)) };
+            if (bytes.length > chunkSize) {
+                result.handle = this.nextHandle++;
+                this.buffers.set(result.handle, bytes);
+            }
+            return result;
+        } catch (e) {
+            return { error: e.toString() };
+        }
+    },
+    read(handle, offset, length) {
+        const bytes = this.buffers.get(handle);
+        if (!bytes) {
+            return { error: `Unknown handle ${handle}` };
+        }
+        return { success: true, base64: this.encode(bytes.subarray(offset, offset + length)) };
+    },
+    async fetchText(url) {
+        try {
+            const response = await fetch(url);
+            if (!response.ok) {
+                return { error: `Fetch failed: ${response.status} ${response.statusText}` };
+            }
+            return { success: true, base64: this.encode(new Uint8Array(await response.arrayBuffer())) };
+        } catch (e) {
+            return { error: e.toString() };
+        }
+    },
+    async fetchTexts(urls) {
+        const items = await Promise.all(urls.map((url) => this.fetchText(url)));
+        return { success: true, items: items };
+    },
+    close(handle) {
+        this.buffers.delete(handle);
+        return { success: true };
+    }
+}"""
+
+
+class FetchError(Exception):
+    """Raised when a resource could not be fetched from the Thorium Reader page."""
+
+
+def page_call(method: str, *args: Any):
+    """Build an expression calling a method of the page-side helper, installing the helper if needed.
+
+    Args:
+        method: _name of the PAGE_FETCHER_JS method to call_
+        args: _JSON-serializable arguments of the method_
+
+    Returns:
+        The JavaScript expression to pass to Runtime.evaluate.
+    """
+    js_args = ", ".join(json.dumps(arg) for arg in args)
+    return f"(globalThis.__lcpFetcher ??= {PAGE_FETCHER_JS}).{method}({js_args})"
+
+
+async def evaluate_in_page(session: DevToolsSession, expression: str, error_context: str = "fetch",
+                           context: ReaderContext | None = None):
+    """Evaluate an async JavaScript expression in the page and return its value.
+
+    Args:
+        session: _DevTools session connected to the Thorium Reader page_
+        expression: _JavaScript expression resolving to { success, ... } or { error }_
+        error_context: _what is being fetched, used in error messages_
+        context: _reader execution context to evaluate in, the target's default context if None_
+
+    Returns:
+        The value returned by the expression if it reports success, otherwise None.
+    """
+    await session.enable("Runtime")
+    params: dict[str, Any] = {
+        "expression": expression,
+        "awaitPromise": True,  # Important: wait for the promise to resolve
+        "returnByValue": True  # Try to get the full value
+    }
+    if context is not None:
+        params["contextId"] = await context.wait()
+    data = await session.send("Runtime.evaluate", params)
+
+    if "result" in data and "exceptionDetails" in data["result"]:
+        logger.warning("Exception during Runtime.evaluate:\n%s",
+                       json.dumps(data["result"]["exceptionDetails"], indent=2))
+        return None
+    if "result" in data and "result" in data["result"]:
+        eval_result = data["result"]["result"].get("value")  # The actual value returned by the JS
+
+        if isinstance(eval_result, dict) and eval_result.get("success"):  # type: ignore
+            return eval_result  # type: ignore
+        elif isinstance(eval_result, dict) and eval_result.get("error"):  # type: ignore
+            logger.warning("Error during %s in page context: %s", error_context, eval_result['error'])
+            return None
+        else:
+            # This case might occur if the JS returns something unexpected
+            logger.warning("Unexpected result from Runtime.evaluate: %s", eval_result)
+            return None
+    elif "error" in data:
+        logger.warning("Error executing Runtime.evaluate: %s (Code: %s)\nDetails: %s",
+                       data['error']['message'], data['error'].get('code'), data['error'].get('data'))
+    return None
+
+
+async def get_content_via_evaluate(session: DevToolsSession, resource_url: str,
+                                   context: ReaderContext | None = None):
     """Fetch content from a resource URL using the Chrome DevTools Protocol's Runtime.evaluate method.
 
+    The content is transferred as base64 and returned as the exact bytes the page received,
+    without being decoded and encoded again on the way.
+
     Args:
-        devtools_ws_url: _webSocketDebuggerUrl of the Chrome DevTools Protocol_
+        session: _DevTools session connected to the Thorium Reader page_
         resource_url: _URL of the resource to fetch content from, typically a file in the epub_
+        context: _reader execution context to fetch in, see `evaluate_in_page`_
 
     Returns:
-        The content of the resource as a string, or None if an error occurs.
-        If the resource is not needed (like nav.xhtml), it returns None.
+        The content of the resource as bytes, or None if an error occurs.
     """
-    async with websockets.connect(devtools_ws_url) as websocket:
-        # Enable Runtime domain
-        await websocket.send(json.dumps({
-            "id": 1,  # Unique message ID
-            "method": "Runtime.enable"
-        }))
-        _ = await websocket.recv()  # Wait for acknowledgment
-        # print(f"Runtime.enable response: {response}")
-
-        # Optional: Get Page Tree to confirm frame context if needed,
-        # but Runtime.evaluate by default runs in the main frame's context
-        # unless a specific contextId is provided.
-        # For fetching a resource URL known to the page, default context is usually fine.
-
-        # JavaScript expression to fetch the content
-        # We use an async IIFE (Immediately Invoked Function Expression)
-        # to handle the promise from fetch.
-        js_resource_url = json.dumps(resource_url)
-        expression = f"""
-        (async () => {{
-            try {{
-                const response = await fetch({js_resource_url});
-                if (!response.ok) {{
-                    return {{ error: `Fetch failed: ${{response.status}} ${{response.statusText}}` }};
-                }}
-                const content = await response.text();
-                return {{ success: true, content: content }};
-            }} catch (e) {{
-                return {{ error: e.toString() }};
-            }}
-        }})()
-        """
-
-        # Execute the expression
-        message_id_evaluate = 2  # Unique message ID
-        await websocket.send(json.dumps({
-            "id": message_id_evaluate,
-            "method": "Runtime.evaluate",
-            "params": {
-                "expression": expression,
-                "awaitPromise": True,  # Important: wait for the promise to resolve
-                "returnByValue": True  # Try to get the full string value
-            }
-        }))
-
-        # Wait for the response
-        while True:
-            response_str = await websocket.recv()
-            data = json.loads(response_str)
-
-            if data.get("id") == message_id_evaluate:
-                if "result" in data and "result" in data["result"]:
-                    eval_result = data["result"]["result"]["value"]  # The actual value returned by the JS
-
-                    if isinstance(eval_result, dict) and eval_result.get("success"):  # type: ignore
-                        assert isinstance(eval_result["content"], str), "Expected content to be a string"
-                        content: str = eval_result["content"]
-                        # print("Content fetched successfully via Runtime.evaluate!")
-                        # with open("downloaded_file_runtime.html", "w", encoding="utf-8") as f:
-                        #     f.write(content)
-                        # print("Saved content to downloaded_file_runtime.html")
-                        return content
-                    elif isinstance(eval_result, dict) and eval_result.get("error"):  # type: ignore
-                        print(f"Error during fetch in page context: {eval_result['error']}")
-                        return None
-                    else:
-                        # This case might occur if the JS returns something unexpected
-                        print(f"Unexpected result from Runtime.evaluate: {eval_result}")
-                        return None
-
-                elif "error" in data:
-                    print(
-                        f"Error executing Runtime.evaluate: {data['error']['message']} (Code: {data['error'].get('code')})")
-                    print(f"Details: {data['error'].get('data')}")
-                    return None
-                elif "result" in data and "exceptionDetails" in data["result"]:
-                    print("Exception during Runtime.evaluate:")
-                    print(json.dumps(data["result"]["exceptionDetails"], indent=2))
-                    return None
-                break  # Exit loop once our message ID is processed
-            # else:
-            #    print(f"Received other message: {data.get('method', data)}")
-
-
-async def get_image_via_evaluate(devtools_ws_url: str, image_url: str):
+    # Runtime.evaluate by default runs in the main frame's context
+    # unless a specific contextId is provided.
+    eval_result = await evaluate_in_page(session, page_call("fetchText", resource_url), context=context)
+    if eval_result is None:
+        return None
+    assert isinstance(eval_result["base64"], str), "Expected content to be a base64 string"
+    return base64.b64decode(eval_result["base64"])
+
+
+async def get_contents_via_evaluate(session: DevToolsSession, resource_urls: list[str],
+                                    context: ReaderContext | None = None):
+    """Fetch the content of several resource URLs with a single Runtime.evaluate round trip.
+
+    Args:
+        session: _DevTools session connected to the Thorium Reader page_
+        resource_urls: _URLs of the resources to fetch content from, typically files in the epub_
+        context: _reader execution context to fetch in, see `evaluate_in_page`_
+
+    Returns:
+        A list with the content of every resource as bytes, or None for resources that could not be fetched.
+        If the whole batch fails, it returns None.
+    """
+    eval_result = await evaluate_in_page(session, page_call("fetchTexts", resource_urls), "batch fetch", context)
+    if eval_result is None:
+        return None
+    contents: list[bytes | None] = []
+    for url, item in zip(resource_urls, eval_result["items"]):
+        if "error" in item:
+            logger.warning("Error during fetch of %s in page context: %s", url, item['error'])
+            contents.append(None)
+        else:
+            contents.append(base64.b64decode(item["base64"]))
+    return contents
+
+
+def base64_size(size: int):
+    """Length of the base64 encoding of `size` bytes."""
+    return (size + 2) // 3 * 4
+
+
+def batch_by_size(items: list[tuple[int, T]], byte_budget: int = BATCH_BYTE_BUDGET,
+                  max_items: int = BATCH_MAX_ITEMS):
+    """Group items into consecutive batches whose combined size stays within a byte budget.
+
+    Args:
+        items: _(size in bytes, item) pairs_
+        byte_budget: _maximum combined size of a batch; larger items get a batch of their own_
+        max_items: _maximum number of items in a batch_
+
+    Returns:
+        A list of batches, each a list of items.
+    """
+    batches: list[list[T]] = []
+    batch: list[T] = []
+    batch_size = 0
+    for size, item in items:
+        if batch and (batch_size + size > byte_budget or len(batch) >= max_items):
+            batches.append(batch)
+            batch, batch_size = [], 0
+        batch.append(item)
+        batch_size += size
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+async def _iter_chunks(session: DevToolsSession, resource_url: str, chunk_size: int, context: ReaderContext | None):
+    """Yield (total size, chunk) pairs of a resource read in fixed-size pieces from a buffer held by the page.
+
+    Raises:
+        FetchError: If the resource or one of its chunks could not be fetched.
+    """
+    opened = await evaluate_in_page(session, page_call("open", resource_url, chunk_size), "image fetch", context)
+    if opened is None:
+        raise FetchError(f"Could not fetch {resource_url}")
+    size: int = opened["size"]
+    handle: int | None = opened.get("handle")
+    yield size, base64.b64decode(opened["base64"])
+    if handle is None:
+        return  # The whole resource fit in the first chunk
+    try:
+        for offset in range(chunk_size, size, chunk_size):
+            chunk = await evaluate_in_page(session, page_call("read", handle, offset, chunk_size), "image fetch",
+                                           context)
+            if chunk is None:
+                raise FetchError(f"Could not read {resource_url} at offset {offset}")
+            yield size, base64.b64decode(chunk["base64"])
+    finally:
+        await evaluate_in_page(session, page_call("close", handle), "image fetch", context)
+
+
+async def get_image_via_evaluate(session: DevToolsSession, image_url: str, chunk_size: int = CHUNK_SIZE,
+                                 context: ReaderContext | None = None):
     """Fetch an image from a URL using the Chrome DevTools Protocol's Runtime.evaluate method.
 
+    The image is transferred in chunks of at most `chunk_size` bytes and assembled into a
+    preallocated buffer, so neither the page nor Python builds one huge string for it.
+
     Args:
-        devtools_ws_url: _webSocketDebuggerUrl of the Chrome DevTools Protocol_
+        session: _DevTools session connected to the Thorium Reader page_
         image_url: _URL of the image to fetch, typically a file in the epub_
+        chunk_size: _maximum number of bytes transferred per Runtime.evaluate call_
+        context: _reader execution context to fetch in, see `evaluate_in_page`_
 
     Returns:
-        The image content as bytes, or None if an error occurs.
-        If the image is not needed, it returns None.
+        The image content as a bytearray, or None if an error occurs.
     """
-    async with websockets.connect(devtools_ws_url) as websocket:
-        await websocket.send(json.dumps({
-            "id": 1,
-            "method": "Runtime.enable"
-        }))
-        await websocket.recv()
-
-        js_image_url = json.dumps(image_url)
-        expression = f"""
-        (async () => {{
-            try {{
-                const response = await fetch({js_image_url});
-                if (!response.ok) {{
-                    return {{ error: `Fetch failed: ${{response.status}} ${{response.statusText}}` }};
-                }}
-                const blob = await response.blob();
-                const arrayBuffer = await blob.arrayBuffer();
-                const uint8Array = new Uint8Array(arrayBuffer);
-                // Convert to base64
-                let binary = '';
-                for (let i = 0; i < uint8Array.length; i++) {{
-                    binary += String.fromCharCode(uint8Array[i]);
-                }}
-                const base64String = btoa(binary);
-                return {{ success: true, base64: base64String }};
-            }} catch (e) {{
-                return {{ error: e.toString() }};
-            }}
-        }})()
-        """
-
-        message_id_evaluate = 2
-        await websocket.send(json.dumps({
-            "id": message_id_evaluate,
-            "method": "Runtime.evaluate",
-            "params": {
-                "expression": expression,
-                "awaitPromise": True,
-                "returnByValue": True
-            }
-        }))
-
-        while True:
-            response_str = await websocket.recv()
-            data = json.loads(response_str)
-
-            if data.get("id") == message_id_evaluate:
-                if "result" in data and "result" in data["result"]:
-                    eval_result = data["result"]["result"]["value"]
-
-                    if isinstance(eval_result, dict) and eval_result.get("success"):  # type: ignore
-                        assert isinstance(eval_result["base64"], str), "Expected base64 to be a string"
-                        base64_data = eval_result["base64"]
-                        # print("Image fetched successfully via Runtime.evaluate!")
-                        # To save as file:
-                        # with open("downloaded_image.png", "wb") as f:
-                        #     f.write(base64.b64decode(base64_data))
-                        return base64.b64decode(base64_data)
-                    elif isinstance(eval_result, dict) and eval_result.get("error"):  # type: ignore
-                        print(f"Error during image fetch in page context: {eval_result['error']}")
-                        return None
-                    else:
-                        print(f"Unexpected result from Runtime.evaluate: {eval_result}")
-                        return None
-
-                elif "error" in data:
-                    print(
-                        f"Error executing Runtime.evaluate: {data['error']['message']} (Code: {data['error'].get('code')})")
-                    print(f"Details: {data['error'].get('data')}")
-                    return None
-                elif "result" in data and "exceptionDetails" in data["result"]:
-                    print("Exception during Runtime.evaluate:")
-                    print(json.dumps(data["result"]["exceptionDetails"], indent=2))
-                    return None
-                break
-
-
-async def fetch_file(base_dir: str, ws_url: str, file_type: str, file: str):
+    buffer: bytearray | None = None
+    offset = 0
+    try:
+        async with aclosing(_iter_chunks(session, image_url, chunk_size, context)) as chunks:
+            async for size, chunk in chunks:
+                if buffer is None:
+                    buffer = bytearray(size)
+                buffer[offset:offset + len(chunk)] = chunk
+                offset += len(chunk)
+    except FetchError as e:
+        logger.warning("%s", e)
+        return None
+    return buffer
+
+
+async def stream_image_via_evaluate(session: DevToolsSession, image_url: str, sink: BinaryIO,
+                                    chunk_size: int = CHUNK_SIZE, context: ReaderContext | None = None):
+    """Fetch an image like `get_image_via_evaluate`, but write every chunk straight to `sink`.
+
+    Args:
+        session: _DevTools session connected to the Thorium Reader page_
+        image_url: _URL of the image to fetch, typically a file in the epub_
+        sink: _binary file object the image is written to_
+        chunk_size: _maximum number of bytes transferred per Runtime.evaluate call_
+        context: _reader execution context to fetch in, see `evaluate_in_page`_
+
+    Returns:
+        The number of bytes written, or None if an error occurs.
+    """
+    written = 0
+    try:
+        async with aclosing(_iter_chunks(session, image_url, chunk_size, context)) as chunks:
+            async for _, chunk in chunks:
+                sink.write(chunk)
+                written += len(chunk)
+    except FetchError as e:
+        logger.warning("%s", e)
+        return None
+    return written
+
+
+def is_text_type(file_type: str):
+    """Whether a manifest media type is fetched as text (XHTML and CSS), in batches of several files."""
+    return file_type.startswith("application/xhtml+xml") or file_type.startswith("text/css")
+
+
+async def fetch_file(resource_url: str, session: DevToolsSession, item: ManifestItem,
+                     context: ReaderContext | None = None):
     """Fetch a file from the epub using the Thorium Reader's remote debugging interface.
 
     Args:
-        base_dir: _base directory of the epub files_
-        ws_url: _webSocketDebuggerUrl of the Thorium Reader_
-        file_type: _mime type of the file_
-        file: _name of the file to fetch_
+        resource_url: _URL the publication is served from, see `utils.get_path.get_base_path`_
+        session: _DevTools session connected to the Thorium Reader page_
+        item: _manifest item of the file to fetch_
+        context: _reader execution context to fetch in, see `evaluate_in_page`_
 
     Returns:
-        A tuple containing the filename and the content of the file, or None if the file is not needed.
-        If the file is nav.xhtml, it returns None, None.
+        The content of the file, bytes for text resources and a bytearray for anything else.
+
+    Raises:
+        FetchError: If the file could not be fetched.
     """
-    if file == "nav.xhtml":
-        return None, None
-    file_path = os.path.normpath(os.path.join(base_dir, file))
-    url = file_path
-    if file_type.startswith("application/xhtml+xml") or file_type.startswith("text/css"):
-        content = await get_content_via_evaluate(ws_url, url)
-        return file_path.split("\\")[-1], content
-    elif file_type.startswith("image/"):
-        content = await get_image_via_evaluate(ws_url, url)
-        return file_path.split("\\")[-1], content
-    return None, None
+    url = resource_url + item.url_path
+    if is_text_type(item.media_type):
+        content: Payload | None = await get_content_via_evaluate(session, url, context)
+    else:
+        content = await get_image_via_evaluate(session, url, context=context)
+    if content is None:
+        raise FetchError(f"Could not fetch {url}")
+    return content
+
+
+async def _fetch_single(resource_url: str, session: DevToolsSession, item: ManifestItem, tracer: Tracer,
+                        context: ReaderContext | None) -> Fetched:
+    start = time.perf_counter()
+    with tracer.span(item.zip_path, "fetch"):
+        if not is_text_type(item.media_type) and item.size > SPILL_SIZE:
+            # Stream large resources straight to a temporary file instead of holding them in memory
+            url = resource_url + item.url_path
+            spool = tempfile.TemporaryFile()
+            if await stream_image_via_evaluate(session, url, spool, context=context) is None:
+                spool.close()
+                raise FetchError(f"Could not fetch {url}")
+            spool.seek(0)
+            content: Payload = spool
+        else:
+            content = await fetch_file(resource_url, session, item, context)
+    if tracer.enabled:
+        tracer.record(item.zip_path, bytes=payload_size(content), fetch_latency=time.perf_counter() - start)
+    return [(item, content)]
+
+
+async def _fetch_batch(scheduler: AdaptiveScheduler[Fetched], resource_url: str, session: DevToolsSession,
+                       batch: list[ManifestItem], key: str, tracer: Tracer, context: ReaderContext | None):
+    urls = [resource_url + item.url_path for item in batch]
+    start = time.perf_counter()
+    with tracer.span(key, "fetch", files=len(batch)):
+        contents = await get_contents_via_evaluate(session, urls, context)
+    latency = time.perf_counter() - start
+    if contents is None:
+        raise FetchError(f"Could not fetch batch of {len(batch)} files starting with {urls[0]}")
+    fetched: Fetched = []
+    for item, content in zip(batch, contents):
+        if content is None:
+            # Retry on its own, so one broken file does not refetch the whole batch
+            scheduler.submit(item.zip_path, item.size,
+                             partial(_fetch_single, resource_url, session, item, tracer, context))
+        else:
+            if tracer.enabled:
+                tracer.record(item.zip_path, bytes=payload_size(content), fetch_latency=latency, batch=key)
+            fetched.append((item, content))
+    return fetched
+
+
+def submit_fetches(scheduler: AdaptiveScheduler[Fetched], resource_url: str, session: DevToolsSession,
+                   items: list[ManifestItem], tracer: Tracer = NULL_TRACER, context: ReaderContext | None = None):
+    """Queue jobs fetching the given manifest items on a scheduler.
+
+    Text resources are grouped by `batch_by_size` and every batch is fetched with one
+    Runtime.evaluate round trip; files that fail inside a batch are resubmitted on their own, and so is
+    every file of a batch that keeps failing as a whole. Only single files end up in `scheduler.failed`,
+    under their zip paths.
+    Other resources get a job each, those larger than SPILL_SIZE are streamed to a temporary file.
+    Every job returns the manifest items and contents of the files it fetched, to be delivered by
+    the `consume` coroutine of `AdaptiveScheduler.run`. The size and fetch latency of every file
+    are recorded on `tracer`.
+
+    Args:
+        scheduler: _scheduler the jobs are submitted to_
+        resource_url: _URL the publication is served from, see `utils.get_path.get_base_path`_
+        session: _DevTools session connected to the Thorium Reader page_
+        items: _manifest items to fetch_
+        tracer: _tracer recording the fetches_
+        context: _reader execution context to fetch in, see `evaluate_in_page`_
+    """
+    text_items: list[tuple[int, ManifestItem]] = []
+    for item in items:
+        if is_text_type(item.media_type):
+            text_items.append((base64_size(item.size), item))
+        else:
+            scheduler.submit(item.zip_path, item.size,
+                             partial(_fetch_single, resource_url, session, item, tracer, context))
+    for batch in batch_by_size(text_items):
+        key = f"batch of {len(batch)} files starting with {batch[0].zip_path}"
+        scheduler.submit(key, sum(item.size for item in batch),
+                         partial(_fetch_batch, scheduler, resource_url, session, batch, key, tracer, context),
+                         partial(_submit_singles, scheduler, resource_url, session, batch, tracer, context))
+
+
+def _submit_singles(scheduler: AdaptiveScheduler[Fetched], resource_url: str, session: DevToolsSession,
+                    items: list[ManifestItem], tracer: Tracer, context: ReaderContext | None):
+    for item in items:
+        scheduler.submit(item.zip_path, item.size,
+                         partial(_fetch_single, resource_url, session, item, tracer, context))
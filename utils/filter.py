@@ -0,0 +1,394 @@
+import asyncio
+import codecs
+import html
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+from html.entities import html5
+from typing import Any, Callable, Generator
+
+from utils.manifest import ManifestIndex
+from utils.repackage import Payload, Pieces
+from utils.trace import NULL_TRACER, Tracer
+
+# Tokens of the document prolog and <head>, in the same spirit as html.parser
+_TOKEN_RE = re.compile(r"""
+    (?P<comment><!--.*?-->)
+  | (?P<pi><\?[^>]*>)
+  | (?P<decl><![^>]*>)
+  | (?P<end></(?P<end_name>[a-zA-Z][^\s/>]*)\s*>)
+  | (?P<start><(?P<name>[a-zA-Z][^\s/>]*)(?P<attrs>(?:[^>"']|"[^"]*"|'[^']*')*)>)
+  | (?P<text>[^<]+)
+""", re.S | re.X)
+_ATTR_RE = re.compile(r"""([^\s/>"'=]+)(?:\s*=\s*("[^"]*"|'[^']*'|[^\s"'>]+))?""")
+_REFERENCE_RE = re.compile(r"&(?=[#a-zA-Z])(?:#[0-9]+;|#[xX][0-9a-fA-F]+;|([a-zA-Z][a-zA-Z0-9]*);)?")
+
+# End of the <head>: everything after it is passed through as bytes
+_HEAD_END_RE = re.compile(rb"</head\s*>", re.I)
+# Encoding declared in the XML declaration
+_XML_ENCODING_RE = re.compile(rb"""^(?:\xef\xbb\xbf)?\s*<\?xml[^>]*?\sencoding\s*=\s*["']([A-Za-z][\w.:-]*)["']""")
+
+# A CPU-bound call of `_filter_steps`: the function and its arguments
+_Step = tuple[Callable[..., bytes | None], tuple[Any, ...]]
+
+# Elements of the head without content
+_VOID_ELEMENTS = ("base", "link", "meta")
+# Elements whose content is not parsed as markup
+_RAW_TEXT_ELEMENTS = ("script", "style")
+# Attributes BeautifulSoup treats as whitespace-separated lists
+_LIST_ATTRIBUTES = {"class", "accesskey", "dropzone"}
+_LINK_LIST_ATTRIBUTES = _LIST_ATTRIBUTES | {"rel", "rev"}
+
+
+class _Unsupported(Exception):
+    """The prolog or head uses markup the fast filter does not handle, use the full parser instead."""
+
+
+def filter_xhtml(content: str):
+    """Filter a fetched xhtml file.
+
+    The fetched xhtml files contains a bunch of javascript/css that is not needed,
+    in the HEAD section we only need the title and the link to the css file, and meta tags.
+    Readium-related attributes are removed from the html tag.
+
+    Only the prolog and <head> are tokenized and rewritten, the rest of the document is kept as is.
+    The rewritten part is serialized exactly like BeautifulSoup does, and documents with markup
+    the tokenizer does not handle fall back to a full BeautifulSoup pass.
+
+    Args:
+        content: _fetched content of the xhtml file_
+
+    Returns:
+        The filtered content.
+    """
+    try:
+        return _filter_head(content)
+    except _Unsupported:
+        return _filter_with_soup(content)
+
+
+def filter_xhtml_bytes(content: bytes | bytearray):
+    """Filter a fetched xhtml file like `filter_xhtml`, keeping it in its original encoding.
+
+    Only the part up to the end of the <head> is decoded and rewritten, the rest of the document is
+    appended as it was fetched. The declared encoding and the XML declaration are left alone, and
+    bytes that are not valid in the declared encoding are kept as they are.
+
+    Args:
+        content: _fetched content of the xhtml file_
+
+    Returns:
+        The filtered content.
+    """
+    steps = _filter_steps(content)
+    try:
+        func, args = next(steps)
+        while True:
+            func, args = steps.send(func(*args))
+    except StopIteration as done:
+        return b"".join(done.value)
+
+
+def _filter_steps(content: bytes | bytearray) -> Generator[_Step, bytes | None, Pieces]:
+    """The steps of `filter_xhtml_bytes`, without running the expensive ones.
+
+    Yields the (function, arguments) calls that decode and rewrite the document, to be sent their results,
+    and returns the filtered content as pieces. The part after the <head> is a view of `content`, so the body
+    is never copied. `filter_xhtml_bytes` runs the calls in place and `HeadFilterPool` on its worker processes,
+    which only get the part up to the end of the <head> unless the document needs the full parser.
+    """
+    encoding = declared_encoding(content)
+    end = head_end(content, encoding)
+    if end is not None:
+        head = yield filter_head_bytes, (bytes(content[:end]), encoding)
+        if head is not None:
+            return head, memoryview(content)[end:]
+    # The head ends further on (its first "</head>" is inside a script) or is not there at all
+    document = yield _filter_document_bytes, (bytes(content), encoding)
+    assert document is not None
+    return (document,)
+
+
+def declared_encoding(content: bytes | bytearray):
+    """Encoding of an xhtml file: from its byte order mark or XML declaration, UTF-8 if it has neither."""
+    if content[:2] in (codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE):
+        return "utf-16"
+    match = _XML_ENCODING_RE.match(content)
+    if match is not None:
+        try:
+            return codecs.lookup(match.group(1).decode("ascii")).name
+        except LookupError:
+            pass
+    return "utf-8"
+
+
+def head_end(content: bytes | bytearray, encoding: str):
+    """Offset just past the </head> end tag, None if there is none or the encoding is not ASCII compatible."""
+    if "</head>".encode(encoding) != b"</head>" or encoding == "utf-7":
+        return None
+    match = _HEAD_END_RE.search(content)
+    return match.end() if match is not None else None
+
+
+def filter_head_bytes(head: bytes, encoding: str):
+    """Filter the part of an xhtml file up to `head_end`.
+
+    Line endings are normalized like BeautifulSoup does, which only affects this part: the rest of the
+    document is appended by the caller as it was fetched, CRLF line endings included.
+
+    Returns:
+        The filtered part in the same encoding, or None if it needs the full parser of `filter_xhtml_bytes`.
+    """
+    text = head.decode(encoding, "surrogateescape").replace("\r\n", "\n").replace("\r", "\n")
+    try:
+        return _encode(_filter_head(text), encoding)
+    except _Unsupported:
+        return None
+
+
+def _filter_document_bytes(content: bytes, encoding: str):
+    return _encode(filter_xhtml(content.decode(encoding, "surrogateescape")), encoding)
+
+
+def _encode(text: str, encoding: str):
+    try:
+        return text.encode(encoding, "surrogateescape")
+    except UnicodeEncodeError:
+        # Unescaped references the encoding cannot represent
+        return text.encode(encoding, "xmlcharrefreplace")
+
+
+def _filter_head(content: str):
+    out: list[str] = []
+    tokens = _TOKEN_RE.finditer(content)
+
+    # Prolog, up to and including the html start tag
+    for token in tokens:
+        if token["start"] and token["name"].lower() == "html":
+            attrs = _parse_attrs(token["attrs"], "html")
+            out.append(_start_tag("html", {k: v for k, v in attrs.items() if "readium" not in k}))
+            break
+        elif token["decl"] and token["decl"][2:10].lower() == "doctype ":
+            out.append(f"<!DOCTYPE {token['decl'][10:-1]}>\n")
+        elif token["comment"] or token["pi"] or (token["text"] and not token["text"].lstrip("\ufeff").strip()):
+            out.append(token[0])
+        else:
+            raise _Unsupported()
+    else:
+        raise _Unsupported()  # No html tag
+
+    # Whitespace and comments up to the head start tag
+    for token in tokens:
+        if token["start"] and token["name"].lower() == "head":
+            break
+        elif token["start"] and token["name"].lower() == "body":
+            return "".join(out) + content[token.start():]  # No head
+        elif token["comment"] or (token["text"] and not token["text"].strip()):
+            out.append(token[0])
+        else:
+            raise _Unsupported()
+    else:
+        raise _Unsupported()
+
+    # Head, keeping only the title, stylesheet links and meta tags
+    title: str | None = None
+    links: list[str] = []
+    metas: list[str] = []
+    unclosed_voids: set[str] = set()
+    position = token.end()
+    while True:
+        token = _TOKEN_RE.match(content, position)
+        if token is None:
+            raise _Unsupported()
+        position = token.end()
+        name = (token["name"] or token["end_name"] or "").lower()
+        if token["end"] and name == "head":
+            break
+        if not token["start"]:
+            continue
+        if name in _VOID_ELEMENTS:
+            if not token[0].endswith("/>"):
+                unclosed_voids.add(name)
+            elif name in unclosed_voids:
+                # BeautifulSoup takes this "/>" for the end of the earlier unclosed tag and leaves this one open
+                raise _Unsupported()
+        if name in _RAW_TEXT_ELEMENTS or name == "title":
+            end = re.compile(rf"</{name}\s*>", re.I).search(content, position)
+            if end is None:
+                raise _Unsupported()
+            text = content[position:end.start()]
+            position = end.end()
+            if name == "title" and title is None:
+                attrs = _parse_attrs(token["attrs"], name)
+                title = _start_tag(name, attrs) + _escape(_unescape_text(text)) + "</title>"
+        elif name == "link":
+            attrs = _parse_attrs(token["attrs"], name)
+            rel = attrs.get("rel")
+            if rel is None or (rel != "stylesheet" and "stylesheet" not in rel.split(" ")):
+                continue
+            # Skip Thorium/Readium specific styles
+            if "thorium" in attrs.get("href", "") or "readium" in attrs.get("href", ""):
+                continue
+            links.append(_start_tag(name, attrs, void=True))
+        elif name == "meta":
+            metas.append(_start_tag(name, _parse_attrs(token["attrs"], name), void=True))
+        elif name not in ("base", "noscript"):
+            raise _Unsupported()
+
+    out.append("<head>")
+    if title is not None:
+        out.append(title)
+    out.extend(links)
+    out.extend(metas)
+    out.append("</head>")
+    if "\r" in content[:position]:
+        raise _Unsupported()  # BeautifulSoup normalizes line endings
+    out.append(content[position:])
+    return "".join(out)
+
+
+def _parse_attrs(text: str, tag_name: str):
+    attrs: dict[str, str] = {}
+    position = 0
+    for match in _ATTR_RE.finditer(text):
+        if text[position:match.start()].strip(" \t\n\f/"):
+            raise _Unsupported()
+        position = match.end()
+        name, value = match.group(1).lower(), match.group(2)
+        if value is None:
+            value = ""
+        elif value[0] in "\"'":
+            value = value[1:-1]
+        value = html.unescape(value)
+        if name in (_LINK_LIST_ATTRIBUTES if tag_name == "link" else _LIST_ATTRIBUTES):
+            value = " ".join(value.split())
+        attrs[name] = value
+    if text[position:].strip(" \t\n\f/"):
+        raise _Unsupported()
+    return attrs
+
+
+def _unescape_text(text: str):
+    if "<" in text:
+        raise _Unsupported()
+    for reference in _REFERENCE_RE.finditer(text):
+        # BeautifulSoup does not keep unknown or unterminated references the way html.unescape does
+        if reference.group(0) == "&" or (reference.group(1) and reference.group(1) + ";" not in html5):
+            raise _Unsupported()
+    return html.unescape(text)
+
+
+def _escape(text: str):
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+
+def _quote(value: str):
+    value = _escape(value)
+    if '"' in value:
+        if "'" in value:
+            return '"' + value.replace('"', "&quot;") + '"'
+        return "'" + value + "'"
+    return '"' + value + '"'
+
+
+def _start_tag(name: str, attrs: dict[str, str], void: bool = False):
+    serialized = "".join(f" {key}={_quote(value)}" for key, value in sorted(attrs.items()))
+    return f"<{name}{serialized}{'/' if void else ''}>"
+
+
+def _filter_with_soup(content: str):
+    from bs4 import BeautifulSoup  # pylint: disable=import-outside-toplevel
+
+    # Filter the content to keep only the title, link to css, and meta tags
+    soup = BeautifulSoup(content, 'html.parser')
+    head = soup.head
+    if head:
+        # Keep only title and link tags
+        title = head.find('title')
+        links = head.find_all('link', rel='stylesheet')
+        metas = head.find_all('meta')
+        new_head = soup.new_tag('head')  # type: ignore
+        if title:
+            new_head.append(title)
+        for link in links:
+            # Skip Thorium/Readium specific styles
+            if "thorium" in link.get('href', '') or "readium" in link.get('href', ''):
+                continue
+            new_head.append(link)
+        for meta in metas:
+            new_head.append(meta)
+        head.replace_with(new_head)
+    # Remove readium-related attributes from the html tag
+    html_tag = soup.find('html')
+    if html_tag:
+        attrs_to_remove: list[str] = [
+            attr for attr in html_tag.attrs if 'readium' in attr.lower()]  # type: ignore
+        for attr in attrs_to_remove:
+            del html_tag[attr]  # type: ignore
+    return str(soup)
+
+
+class HeadFilterPool:
+    """Filter step of the repackaging pipeline, running the xhtml filter on a pool of worker processes.
+
+    Only xhtml files are sent to the workers, everything else is passed through unchanged.
+    Fetched bytes go through the steps of `filter_xhtml_bytes`, but only the part up to the end of the <head>
+    crosses to the workers; the body is never decoded, copied or sent between processes, and is returned
+    as a view after the filtered head, see `utils.repackage.Pieces`.
+    With a manifest index, files are recognized by their manifest media type instead of their extension.
+    One pool can serve several books by passing each book's index to `filter`.
+
+    Usage:
+        with HeadFilterPool(index) as head_filter:
+            content = await head_filter("OEBPS/Text/chapter1.xhtml", content)
+            content = await head_filter.filter("OEBPS/Text/chapter1.xhtml", content, other_index)
+    """
+
+    def __init__(self, index: ManifestIndex | None = None, max_workers: int | None = None,
+                 tracer: Tracer = NULL_TRACER):
+        self.index = index
+        self.tracer = tracer
+        self._executor = ProcessPoolExecutor(max_workers=max_workers)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info: object):
+        self._executor.shutdown(cancel_futures=True)
+
+    @property
+    def executor(self):
+        """The pool of worker processes, for other CPU-bound steps of the pipeline."""
+        return self._executor
+
+    async def __call__(self, zip_path: str, content: Payload) -> Payload | Pieces:
+        return await self.filter(zip_path, content, self.index)
+
+    async def filter(self, zip_path: str, content: Payload, index: ManifestIndex | None = None) -> Payload | Pieces:
+        """Filter a delivered file if it is xhtml, looking its media type up in `index`."""
+        if not _is_xhtml(zip_path, index) or not isinstance(content, (str, bytes, bytearray)):
+            return content
+        start = time.perf_counter()
+        with self.tracer.span(zip_path, "filter"):
+            content = await self._filter(content)
+        self.tracer.record(zip_path, filter_time=time.perf_counter() - start)
+        return content
+
+    async def _filter(self, content: str | bytes | bytearray) -> Payload | Pieces:
+        loop = asyncio.get_running_loop()
+        if isinstance(content, str):
+            return await loop.run_in_executor(self._executor, filter_xhtml, content)
+        steps = _filter_steps(content)
+        try:
+            func, args = next(steps)
+            while True:
+                func, args = steps.send(await loop.run_in_executor(self._executor, func, *args))
+        except StopIteration as done:
+            return done.value
+
+
+def _is_xhtml(zip_path: str, index: ManifestIndex | None):
+    item = index.get(zip_path) if index is not None else None
+    if item is None:
+        return zip_path.endswith(".xhtml")
+    return item.media_type.startswith("application/xhtml+xml")
@@ -1,9 +1,17 @@
 import threading
 import time
 
-import win32con
-import win32gui
-import win32process
+try:
+    import win32con
+    import win32gui
+    import win32process
+except ImportError:  # Not on Windows, or pywin32 is not installed
+    win32gui = None
+
+
+def is_available():
+    """Whether windows can be hidden here: on Windows, with pywin32 installed."""
+    return win32gui is not None
 
 
 def hide_visible_window_by_pid(hwnd: int, pid: int):
@@ -25,3 +33,33 @@ def monitor_and_hide_program_by_pid(pid: int, stop_event: threading.Event):
     while not stop_event.is_set():
         win32gui.EnumWindows(lambda hwnd, _: hide_visible_window_by_pid(hwnd, pid), None)
         time.sleep(0.2)  # Adjust as needed
+
+
+class WindowHider:
+    """Hides every window of a process as soon as it becomes visible, until stopped.
+
+    Usage:
+        hider = WindowHider(pid)
+        hider.start()
+        ...
+        hider.stop()
+    """
+
+    def __init__(self, pid: int):
+        self.pid = pid
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self):
+        """Start watching the windows of the process on a background thread."""
+        # This thread will hide any Thorium Reader window if it becomes visible
+        self._thread = threading.Thread(target=monitor_and_hide_program_by_pid, args=(self.pid, self._stop),
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop hiding windows and wait for the background thread to finish."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
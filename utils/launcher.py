@@ -0,0 +1,255 @@
+import asyncio
+import logging
+import os
+import re
+import shutil
+import subprocess
+import sys
+from typing import TYPE_CHECKING, Any
+from urllib.parse import urlsplit
+
+import websockets
+
+from utils.devtools import DevToolsSession
+from utils.get_path import READER_URL_SUBSTRING
+from utils.trace import NULL_TRACER, Tracer
+
+if TYPE_CHECKING:
+    from utils.hide_windows import WindowHider
+
+# Line Chromium/Electron prints to stderr once the remote debugger accepts connections
+_DEVTOOLS_LISTENING_RE = re.compile(rb"DevTools listening on (ws://\S+)")
+
+logger = logging.getLogger(__name__)
+
+
+def is_thorium_running(thorium_path: str):
+    """Check whether a Thorium Reader process is already running.
+
+    Args:
+        thorium_path: _path to the Thorium Reader executable_
+
+    Returns:
+        True if a process with the same executable name is running, False if not or if it cannot be checked.
+    """
+    name = os.path.basename(thorium_path)
+    if sys.platform.startswith("win"):
+        tasks = subprocess.run(['tasklist'], capture_output=True, text=True).stdout
+        return any(name.lower() in task.lower() for task in tasks.splitlines())
+    if shutil.which("pgrep"):
+        return subprocess.run(['pgrep', '-x', name[:15]], capture_output=True).returncode == 0
+    return False
+
+
+class ThoriumLauncher:
+    """Launches Thorium Reader with its remote debugger on an ephemeral port.
+
+    The debugger endpoint is taken from the "DevTools listening on" line Thorium prints on startup,
+    and `wait_for_reader` subscribes to target discovery and resolves the moment the reader target
+    showing the publication appears, instead of polling the HTTP endpoint.
+
+    The browser connection stays open while Thorium runs, so more publications can be opened in the
+    same instance with `open_publication`, and their readers closed again with `close_reader`.
+    On Windows, Thorium's windows are hidden while a publication opens, if pywin32 is installed.
+
+    Usage:
+        async with ThoriumLauncher(thorium_path, epub_path) as launcher:
+            target_id, ws_url = await launcher.wait_for_reader()
+            ...
+            await launcher.close_reader(target_id)
+            target_id, ws_url = await launcher.open_publication(other_epub_path)
+    """
+
+    def __init__(self, thorium_path: str, epub_path: str, timeout: float = 60.0, tracer: Tracer = NULL_TRACER,
+                 hide_windows: bool = True):
+        """
+        Args:
+            thorium_path: _path to the Thorium Reader executable_
+            epub_path: _path to the epub file to open_
+            timeout: _seconds to wait for the debugger and for the reader to appear_
+            tracer: _tracer recording the launch and readiness stages_
+            hide_windows: _hide Thorium's windows, only supported on Windows_
+        """
+        self.thorium_path = thorium_path
+        self.epub_path = epub_path
+        self.timeout = timeout
+        self.tracer = tracer
+        self.hide_windows = hide_windows and sys.platform.startswith("win")
+        self.process: asyncio.subprocess.Process | None = None
+        self.browser_ws_url: str | None = None
+        self._browser: DevToolsSession | None = None
+        self._readers: dict[str, dict[str, Any]] = {}  # Reader targets not returned by wait_for_reader yet
+        self._claimed: set[str] = set()
+        self._reader_appeared = asyncio.Event()
+        self._stderr_task: asyncio.Task[None] | None = None
+        self._hider: WindowHider | None = None
+
+    async def __aenter__(self):
+        try:
+            await self.start()
+        except BaseException:
+            await self.stop()
+            raise
+        return self
+
+    async def __aexit__(self, *exc_info: object):
+        await self.stop()
+
+    async def start(self):
+        """Launch Thorium Reader and wait until its remote debugger is listening.
+
+        Raises:
+            TimeoutError: If the debugger does not announce itself within the timeout.
+            RuntimeError: If Thorium Reader exits before its debugger is listening.
+        """
+        with self.tracer.stage("launch"):
+            await self._launch()
+            await self._watch_targets(self.browser_ws_url)
+        # Keep draining stderr so Thorium never blocks on a full pipe
+        self._stderr_task = asyncio.create_task(self._drain_stderr())
+
+    async def _launch(self):
+        self.process = await asyncio.create_subprocess_exec(
+            self.thorium_path,
+            self.epub_path,
+            "--remote-debugging-port=0",
+            "--remote-allow-origins=*",
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        self._start_hiding_windows(self.process.pid)
+        try:
+            self.browser_ws_url = await asyncio.wait_for(self._read_devtools_url(), self.timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError("Thorium Reader remote debugger did not start in time") from None
+
+    async def _watch_targets(self, browser_ws_url: str | None):
+        assert browser_ws_url is not None
+        self._browser = DevToolsSession(browser_ws_url)
+        await self._browser.connect()
+        self._browser.add_listener("Target.targetCreated", self._on_target)
+        self._browser.add_listener("Target.targetInfoChanged", self._on_target)
+        self._browser.add_listener("Target.targetDestroyed", self._on_target_destroyed)
+        await self._browser.send("Target.setDiscoverTargets", {"discover": True})
+
+    def _on_target(self, params: dict[str, Any]):
+        target_info = params["targetInfo"]
+        target_id = target_info["targetId"]
+        if READER_URL_SUBSTRING in target_info.get("url", "") and target_id not in self._claimed:
+            self._readers[target_id] = target_info
+            self._reader_appeared.set()
+
+    def _on_target_destroyed(self, params: dict[str, Any]):
+        self._readers.pop(params["targetId"], None)
+
+    async def wait_for_reader(self):
+        """Wait for a reader target displaying a publication that was not returned before.
+
+        Returns:
+            The targetId and webSocketDebuggerUrl of the reader target.
+
+        Raises:
+            TimeoutError: If no reader target appears within the timeout.
+        """
+        assert self.browser_ws_url is not None, "Thorium Reader has not been started"
+        with self.tracer.stage("ready"):
+            try:
+                target_id = await asyncio.wait_for(self._next_reader(), self.timeout)
+            except asyncio.TimeoutError:
+                raise TimeoutError("Thorium Reader did not open the publication in time") from None
+        self._stop_hiding_windows()
+        endpoint = urlsplit(self.browser_ws_url).netloc
+        return target_id, f"ws://{endpoint}/devtools/page/{target_id}"
+
+    async def _next_reader(self):
+        while not self._readers:
+            self._reader_appeared.clear()
+            await self._reader_appeared.wait()
+        target_id = next(iter(self._readers))
+        del self._readers[target_id]
+        self._claimed.add(target_id)
+        return target_id
+
+    async def open_publication(self, epub_path: str):
+        """Open another publication in the running Thorium Reader and wait for its reader.
+
+        Thorium Reader only runs once: starting the executable again with a file forwards the file to
+        the running instance, which opens it in a new reader window.
+
+        Args:
+            epub_path: _path to the epub file to open_
+
+        Returns:
+            The targetId and webSocketDebuggerUrl of the new reader target.
+        """
+        assert self.process is not None, "Thorium Reader has not been started"
+        self._start_hiding_windows(self.process.pid)
+        forwarder = await asyncio.create_subprocess_exec(
+            self.thorium_path, epub_path, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL)
+        try:
+            return await self.wait_for_reader()
+        finally:
+            try:
+                await asyncio.wait_for(forwarder.wait(), self.timeout)
+            except asyncio.TimeoutError:
+                forwarder.kill()
+                await forwarder.wait()
+
+    async def close_reader(self, target_id: str):
+        """Close a reader target returned by `wait_for_reader` or `open_publication`.
+
+        Errors are only reported: this runs in cleanup, where Thorium Reader may already have exited,
+        and must not replace the error that ended the fetch.
+        """
+        if self._browser is not None:
+            try:
+                await self._browser.send("Target.closeTarget", {"targetId": target_id})
+            except (ConnectionError, websockets.ConnectionClosed) as e:
+                logger.warning("Could not close the reader window: %r", e)
+
+    async def stop(self):
+        """Terminate Thorium Reader."""
+        self._stop_hiding_windows()
+        if self._browser is not None:
+            await self._browser.close()
+            self._browser = None
+        if self.process is not None and self.process.returncode is None:
+            self.process.terminate()
+            try:
+                await asyncio.wait_for(self.process.wait(), 10)
+            except asyncio.TimeoutError:
+                self.process.kill()
+                await self.process.wait()
+        if self._stderr_task is not None:
+            await self._stderr_task
+
+    async def _read_devtools_url(self):
+        assert self.process is not None and self.process.stderr is not None
+        while line := await self.process.stderr.readline():
+            match = _DEVTOOLS_LISTENING_RE.search(line)
+            if match:
+                return match.group(1).decode()
+        raise RuntimeError("Thorium Reader exited before its remote debugger was listening")
+
+    async def _drain_stderr(self):
+        assert self.process is not None and self.process.stderr is not None
+        while await self.process.stderr.read(64 * 1024):
+            pass
+
+    def _start_hiding_windows(self, pid: int):
+        if not self.hide_windows or self._hider is not None:
+            return
+        # Only imported where it is used: it needs pywin32, which only exists on Windows
+        from utils.hide_windows import WindowHider, is_available  # pylint: disable=import-outside-toplevel
+
+        if not is_available():
+            logger.warning("pywin32 is not installed, Thorium Reader windows will not be hidden.")
+            self.hide_windows = False
+            return
+        self._hider = WindowHider(pid)
+        self._hider.start()
+
+    def _stop_hiding_windows(self):
+        if self._hider is not None:
+            self._hider.stop()
+            self._hider = None
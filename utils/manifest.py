@@ -0,0 +1,121 @@
+import posixpath
+import xml.etree.ElementTree as ET
+import zipfile
+from dataclasses import dataclass
+from urllib.parse import unquote
+
+OPF_NS = {'opf': 'http://www.idpf.org/2007/opf'}
+ENC_NS = {'enc': 'http://www.w3.org/2001/04/xmlenc#'}
+
+ENCRYPTION_XML = "META-INF/encryption.xml"
+
+
+def normalize_zip_path(path: str):
+    """Normalize a path inside the epub container, e.g. "OEBPS/Text/../Images/a.jpg" -> "OEBPS/Images/a.jpg"."""
+    return posixpath.normpath(path).lstrip("/")
+
+
+@dataclass(frozen=True)
+class ManifestItem:
+    """A resource listed in the package manifest.
+
+    Attributes:
+        href: _href as written in the manifest (URL-encoded, relative to package.opf)_
+        url_path: _URL-encoded path of the resource relative to the container root_
+        zip_path: _normalized path of the resource's zip entry_
+        media_type: _mime type of the resource_
+        size: _size of the resource in bytes: its OriginalLength in encryption.xml if it is compressed before being
+            encrypted, the size of its zip entry otherwise, 0 if the entry is missing_
+        encrypted: _whether encryption.xml lists the resource as encrypted_
+        nav: _whether the resource is the navigation document (properties="nav")_
+    """
+    href: str
+    url_path: str
+    zip_path: str
+    media_type: str
+    size: int
+    encrypted: bool
+    nav: bool
+
+
+def is_fetched(item: ManifestItem):
+    """Whether a manifest item has to be fetched from Thorium Reader.
+
+    Only encrypted resources do, except the navigation document, which is copied from the epub as is.
+    """
+    return item.encrypted and not item.nav
+
+
+class ManifestIndex:
+    """Index of the manifest of an epub, built once from container.xml, package.opf and encryption.xml.
+
+    Maps the normalized zip path of every manifest item to its `ManifestItem`.
+
+    Usage:
+        index = ManifestIndex.from_epub(epub_path)
+        item = index.get("OEBPS/Text/chapter1.xhtml")
+    """
+
+    def __init__(self, opf_path: str, items: list[ManifestItem]):
+        self.opf_path = opf_path
+        self.items: dict[str, ManifestItem] = {item.zip_path: item for item in items}
+
+    @classmethod
+    def from_epub(cls, epub_path: str):
+        """Build the index of an epub file.
+
+        Args:
+            epub_path: _path to the epub file_
+
+        Returns:
+            The manifest index of the epub.
+        """
+        with zipfile.ZipFile(epub_path, 'r') as zf:
+            # Find the path to package.opf from META-INF/container.xml
+            with zf.open("META-INF/container.xml") as f:
+                rootfile = ET.parse(f).find(".//{*}rootfile")
+                assert rootfile is not None, "No rootfile found in container.xml"
+                opf_path = rootfile.attrib['full-path']
+            with zf.open(opf_path) as f:
+                manifest = ET.parse(f).find('.//opf:manifest', OPF_NS)
+                assert manifest is not None, "No manifest found in package.opf"
+
+            # Sizes let the scheduler start the largest resources first and batch small ones
+            sizes = {normalize_zip_path(info.filename): info.file_size for info in zf.infolist()}
+
+            encrypted: set[str] = set()
+            if ENCRYPTION_XML in zf.NameToInfo:
+                with zf.open(ENCRYPTION_XML) as f:
+                    for data in ET.parse(f).iterfind('.//enc:EncryptedData', ENC_NS):
+                        reference = data.find('.//enc:CipherReference', ENC_NS)
+                        if reference is None:
+                            continue
+                        zip_path = normalize_zip_path(unquote(reference.attrib['URI']))
+                        encrypted.add(zip_path)
+                        # The entry of a resource compressed before it was encrypted holds the ciphertext,
+                        # the size of the decrypted resource is in the Compression encryption property
+                        compression = data.find('.//{*}Compression')
+                        if compression is not None and compression.get('OriginalLength', '').isdigit():
+                            sizes[zip_path] = int(compression.attrib['OriginalLength'])
+
+        opf_dir = posixpath.dirname(opf_path)
+        items: list[ManifestItem] = []
+        for element in manifest.iterfind('opf:item', OPF_NS):
+            href = element.attrib['href']
+            url_path = normalize_zip_path(posixpath.join(opf_dir, href))
+            zip_path = unquote(url_path)
+            nav = "nav" in element.attrib.get('properties', "").split()
+            items.append(ManifestItem(href, url_path, zip_path, element.attrib['media-type'],
+                                      sizes.get(zip_path, 0), zip_path in encrypted, nav))
+        return cls(opf_path, items)
+
+    def get(self, zip_path: str):
+        """Look up the manifest item of a zip entry, None if the entry is not in the manifest."""
+        return self.items.get(normalize_zip_path(zip_path))
+
+    def encrypted_items(self):
+        """Manifest items listed as encrypted, which are the only ones that need to be fetched."""
+        return [item for item in self.items.values() if item.encrypted]
+
+    def __len__(self):
+        return len(self.items)
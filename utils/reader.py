@@ -0,0 +1,264 @@
+import asyncio
+import os
+import time
+from contextlib import AsyncExitStack
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Callable
+
+from utils import default_output_path
+from utils.cache import FetchCache, book_id
+from utils.filter import HeadFilterPool
+from utils.manifest import ManifestIndex, ManifestItem, is_fetched
+from utils.repackage import Payload, StreamingRepackager
+from utils.scheduler import AdaptiveScheduler
+from utils.trace import NULL_TRACER, Progress, Tracer
+from utils.verify import VerificationReport, verify_epub
+
+# The modules talking to Thorium Reader (and websockets) are only imported once a book has to be fetched
+if TYPE_CHECKING:
+    from utils.fetch import Deliver, Fetched
+    from utils.launcher import ThoriumLauncher
+
+
+class ReaderUnavailableError(RuntimeError):
+    """Raised when Thorium Reader cannot be launched because another instance of it is running."""
+
+
+@dataclass
+class FetchResult:
+    """Outcome of `ReaderSession.fetch_epub`.
+
+    Attributes:
+        epub_path: _path to the source epub_
+        out_epub: _path the repackaged epub was written to_
+        fetched: _zip paths of the files fetched from Thorium Reader_
+        from_cache: _zip paths of the files taken from the fetch cache_
+        failed: _zip paths of the files that could not be fetched, with their last error; their original
+            content was kept_
+        elapsed: _seconds the book took_
+        verification: _result of checking the repackaged epub, None if it was not verified_
+    """
+    epub_path: str
+    out_epub: str
+    fetched: list[str] = field(default_factory=list)
+    from_cache: list[str] = field(default_factory=list)
+    failed: dict[str, str] = field(default_factory=dict)
+    elapsed: float = 0.0
+    verification: VerificationReport | None = None
+
+    @property
+    def complete(self):
+        """Whether every encrypted file was replaced by its decrypted content."""
+        return not self.failed and (self.verification is None or self.verification.ok)
+
+
+class ReaderSession:
+    """Fetches any number of books through one Thorium Reader instance.
+
+    Thorium Reader is launched the first time a book has files missing from the fetch cache, and stays
+    running with its debugger connection until the session is closed: later books are opened in the same
+    instance, and every reader window is closed once its book is done. The pool of head filter processes
+    is shared by all books as well.
+
+    The outcome of every book is returned as a `FetchResult`. Retries, page errors and damaged cache entries
+    are not printed but reported through `logging`, under the "utils" loggers.
+
+    Usage:
+        async with ReaderSession() as reader:
+            result = await reader.fetch_epub("book.epub", "book_fetched.epub")
+    """
+
+    def __init__(self, thorium_path: str | None = None, max_concurrency: int = 16, cache_dir: str | None = None,
+                 timeout: float = 60.0, confirm_launch: Callable[[], bool] | None = None, progress: bool = False,
+                 hide_windows: bool = True, verify: bool = True, tracer: Tracer = NULL_TRACER):
+        """
+        Args:
+            thorium_path: _path to the Thorium Reader executable, found with `find_thorium_path` if None_
+            max_concurrency: _maximum number of resources fetched at the same time_
+            cache_dir: _directory of the fetch cache, defaults to `utils.cache.default_cache_dir()`_
+            timeout: _seconds to wait for Thorium Reader to start and to open a book_
+            confirm_launch: _called while another Thorium Reader is running when ours has to be launched; it should
+                return True once that instance was closed, or False to give up. Without it, launching gives up_
+            progress: _draw a live progress line while fetching_
+            hide_windows: _hide the windows of Thorium Reader, only supported on Windows with pywin32_
+            verify: _check every repackaged epub with `utils.verify.verify_epub`; cached copies of the files that
+                fail are discarded, so the next run fetches them again_
+            tracer: _tracer recording the stages of every book and every fetched resource_
+        """
+        self.thorium_path = thorium_path
+        self.max_concurrency = max_concurrency
+        self.cache = FetchCache(cache_dir)
+        self.timeout = timeout
+        self.confirm_launch = confirm_launch
+        self.progress = progress
+        self.hide_windows = hide_windows
+        self.verify = verify
+        self.tracer = tracer
+        self._stack = AsyncExitStack()
+        self._launcher: "ThoriumLauncher | None" = None
+        self._launch_lock = asyncio.Lock()
+        self._head_filter: HeadFilterPool | None = None
+
+    async def __aenter__(self):
+        self._head_filter = self._stack.enter_context(HeadFilterPool(tracer=self.tracer))
+        return self
+
+    async def __aexit__(self, *exc_info: object):
+        try:
+            await self._stack.aclose()
+        finally:
+            with self.tracer.stage("evict"):
+                await asyncio.to_thread(self.cache.evict)
+
+    async def fetch_epub(self, epub_path: str, out_epub: str | None = None, index: ManifestIndex | None = None):
+        """Fetch the decrypted content of an epub and write the repackaged epub.
+
+        Files fetched before are taken from the fetch cache, so an interrupted book can be resumed and a fully
+        cached book is repackaged without Thorium Reader. An existing output file is replaced, and the output
+        is removed again if fetching fails. The written epub is verified afterwards unless disabled.
+
+        Args:
+            epub_path: _path to the epub file to fetch content from_
+            out_epub: _path the repackaged epub is written to, see `default_output_path`_
+            index: _manifest index of the epub if it was already loaded_
+
+        Returns:
+            A `FetchResult` listing what was fetched, reused and kept, and what failed verification.
+
+        Raises:
+            FileNotFoundError: If the epub does not exist.
+            ReaderUnavailableError: If Thorium Reader is needed but another instance of it is running.
+            TimeoutError: If Thorium Reader does not start or open the book in time.
+            RuntimeError: If Thorium Reader exits early or does not show where it serves the book from.
+        """
+        assert self._head_filter is not None, "ReaderSession is not open"
+        started = time.monotonic()
+        if not os.path.exists(epub_path):
+            raise FileNotFoundError(f"The file {epub_path} does not exist.")
+        result = FetchResult(epub_path, out_epub or default_output_path(epub_path))
+
+        # 1. Index the manifest; only the encrypted resources have to be fetched
+        if index is None:
+            with self.tracer.stage("index"):
+                index = ManifestIndex.from_epub(epub_path)
+        items = [item for item in index.items.values() if is_fetched(item)]
+        replaced = {item.zip_path for item in items}
+
+        # 2. Look up the files fetched by previous runs, only the rest has to be fetched from Thorium Reader
+        book = await asyncio.to_thread(book_id, epub_path)
+        limit = asyncio.Semaphore(self.max_concurrency)
+        head_filter = self._head_filter
+        book_index = index
+
+        async def transform(zip_path: str, content: Payload):
+            return await head_filter.filter(zip_path, content, book_index)
+
+        # 3-5. Fetch, filter and repackage as a pipeline
+        # Unchanged entries are copied to the new epub right away and every fetched file is
+        # filtered (on a pool of worker processes) and written the moment it arrives.
+        async with StreamingRepackager(epub_path, result.out_epub, replaced, transform,
+                                       tracer=self.tracer) as repackager:
+
+            async def replay(item: ManifestItem):
+                async with limit:
+                    content = await asyncio.to_thread(self.cache.get, book, item.href)
+                    if content is not None:
+                        await repackager.put(item.zip_path, content)
+                    return content is not None
+
+            async def deliver(item: ManifestItem, content: Payload):
+                await asyncio.to_thread(self.cache.put, book, item.href, content)
+                await repackager.put(item.zip_path, content)
+
+            with self.tracer.stage("cache"):
+                cached = [item for item in items if self.cache.contains(book, item.href)]
+                replayed = await asyncio.gather(*(replay(item) for item in cached))
+            result.from_cache = [item.zip_path for item, ok in zip(cached, replayed) if ok]
+            self.tracer.count("files from cache", len(result.from_cache))
+
+            from_cache = set(result.from_cache)
+            missing = [item for item in items if item.zip_path not in from_cache]
+            if missing:
+                await self._fetch(epub_path, missing, deliver, result)
+
+        # 6. Verify the written epub on the worker processes, and forget the cached copies of bad files
+        if self.verify:
+            with self.tracer.stage("verify"):
+                result.verification = await verify_epub(result.out_epub, epub_path, index, head_filter.executor)
+            for item in result.verification.refetch:
+                self.cache.discard(book, item.href)
+            self.tracer.count("files failing verification", len(result.verification.issues))
+        result.elapsed = time.monotonic() - started
+        return result
+
+    async def _fetch(self, epub_path: str, items: list[ManifestItem], deliver: "Deliver", result: FetchResult):
+        # pylint: disable=import-outside-toplevel
+        from utils.context import ReaderContext
+        from utils.devtools import DevToolsSession
+        from utils.fetch import submit_fetches
+
+        # 3.1-3.3 Open the book in Thorium Reader and get the webSocketDebuggerUrl of its reader
+        launcher, (target_id, ws_url) = await self._open(epub_path)
+        try:
+            # 3.4 Fetch the files
+            # The scheduler bounds and adapts the number of concurrent evaluates to their round trip latency
+            # and retries failures, small text resources are fetched in batches of one evaluate each
+            # Fetched files are delivered (cached, filtered and written) outside the fetch jobs
+            # All fetches share a single multiplexed connection to the debugger
+            # Every fetch runs in the reader frame's execution context, followed across reloads
+            async with DevToolsSession(ws_url) as session:
+                context = ReaderContext(session, self.timeout)
+                resource_url = await context.start()
+
+                progress = Progress(len(items), sum(item.size for item in items))
+                if not self.progress:
+                    progress.enabled = False
+
+                async def deliver_with_progress(item: ManifestItem, content: Payload):
+                    await deliver(item, content)
+                    result.fetched.append(item.zip_path)
+                    progress.update(item.size)
+
+                async def consume(_key: str, fetched: "Fetched"):
+                    await asyncio.gather(*(deliver_with_progress(item, content) for item, content in fetched))
+
+                def observe(method: str, latency: float):
+                    if method == "Runtime.evaluate":
+                        scheduler.observe(latency)
+
+                scheduler = AdaptiveScheduler["Fetched"](max_concurrency=self.max_concurrency, tracer=self.tracer)
+                session.add_round_trip_listener(observe)
+                submit_fetches(scheduler, resource_url, session, items, self.tracer, context)
+                with self.tracer.stage("fetch"):
+                    await scheduler.run(consume)
+                progress.close()
+                for method, n in session.sent.items():
+                    self.tracer.count(f"websocket sent {method}", n)
+                for kind, n in session.received.items():
+                    self.tracer.count(f"websocket received {kind}", n)
+                self.tracer.count("websocket bytes received", session.bytes_received)
+                self.tracer.count("reader contexts lost", context.lost)
+        finally:
+            await launcher.close_reader(target_id)
+        result.failed = {key: repr(error) for key, error in scheduler.failed.items()}
+
+    async def _open(self, epub_path: str) -> "tuple[ThoriumLauncher, tuple[str, str]]":
+        # pylint: disable=import-outside-toplevel
+        from utils import find_thorium_path
+        from utils.launcher import ThoriumLauncher, is_thorium_running
+
+        async with self._launch_lock:
+            if self._launcher is not None:
+                return self._launcher, await self._launcher.open_publication(epub_path)
+
+            # Another Thorium Reader would take the book without a debugger, so it has to be closed first
+            thorium_path = self.thorium_path or find_thorium_path()
+            while is_thorium_running(thorium_path):
+                if self.confirm_launch is None or not self.confirm_launch():
+                    raise ReaderUnavailableError("Thorium Reader is already running")
+
+            # Launch Thorium Reader with debug args, on an ephemeral debugging port
+            launcher = ThoriumLauncher(thorium_path, epub_path, self.timeout, self.tracer, self.hide_windows)
+            await self._stack.enter_async_context(launcher)
+            self._launcher = launcher
+            return launcher, await launcher.wait_for_reader()
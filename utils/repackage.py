@@ -0,0 +1,251 @@
+import asyncio
+import os
+import struct
+import tempfile
+import zipfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import IO, Awaitable, Callable, Union
+
+from utils.manifest import normalize_zip_path
+from utils.trace import NULL_TRACER, Tracer
+
+# Content delivered for an entry: text, bytes, or a (spooled) temporary file positioned at its start
+Payload = Union[str, bytes, bytearray, IO[bytes]]
+# Content assembled from pieces written one after the other, like a rewritten head and a view of the untouched body
+Pieces = tuple[Union[bytes, bytearray, memoryview], ...]
+
+# Entries that only make sense in the protected epub and are left out of the repackaged one
+SKIPPED_ENTRIES = ("mimetype", "META-INF/encryption.xml", "META-INF/license.lcpl")
+
+# Already compressed media, stored as is instead of being deflated again
+STORED_EXTENSIONS = (
+    ".jpg", ".jpeg", ".png", ".gif", ".webp", ".avif", ".woff", ".woff2",
+    ".mp3", ".m4a", ".aac", ".ogg", ".opus", ".mp4", ".m4v", ".webm", ".zip",
+)
+
+# Size of the pieces large payloads are copied and compressed in
+COPY_CHUNK_SIZE = 1024 * 1024
+
+# (CRC-32, uncompressed size, compression method, compressed size, compressed data) of an entry
+_Compressed = tuple[int, int, int, int, Union[Pieces, IO[bytes]]]
+
+
+class StreamingRepackager:
+    """Writes the repackaged epub in a single pass while resources are still being fetched.
+
+    All zip I/O runs on a single writer thread. Entries that will not be replaced are copied from
+    the source epub as soon as the repackager is opened, as raw compressed streams with their
+    existing CRC, while the caller goes on fetching. Fetched entries are passed through the `transform`
+    coroutine, compressed on a pool of threads following `compress_type_for`, and written behind that
+    copy the moment they are delivered with `put`. Entries whose fetch never arrived are copied raw from
+    the source when it is closed.
+
+    Usage:
+        async with StreamingRepackager(epub_path, out_epub, replaced, transform) as repackager:
+            await repackager.put("OEBPS/Text/chapter1.xhtml", content)
+    """
+
+    def __init__(self, epub_path: str, out_epub: str, replaced: set[str],
+                 transform: Callable[[str, Payload], Awaitable[Payload | Pieces]] | None = None,
+                 compress_workers: int | None = None, tracer: Tracer = NULL_TRACER):
+        """
+        Args:
+            epub_path: _path to the source epub_
+            out_epub: _path the repackaged epub is written to_
+            replaced: _normalized zip paths (see `utils.manifest`) of the entries that will be delivered with `put`_
+            transform: _optional coroutine function applied to every delivered payload before it is written_
+            compress_workers: _number of threads compressing delivered payloads, defaults to the CPU count_
+            tracer: _tracer recording the time spent copying unchanged entries and finishing the archive_
+        """
+        self.epub_path = epub_path
+        self.out_epub = out_epub
+        self.replaced = replaced
+        self.transform = transform
+        self.written = 0
+        self.tracer = tracer
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="repackager")
+        self._compressor = ThreadPoolExecutor(max_workers=compress_workers, thread_name_prefix="compressor")
+        self._source: zipfile.ZipFile | None = None
+        self._source_fp: IO[bytes] | None = None
+        self._out: zipfile.ZipFile | None = None
+        self._pending: dict[str, zipfile.ZipInfo] = {}
+        self._opened: asyncio.Future[None] | None = None
+
+    async def __aenter__(self):
+        # Not awaited: the copy of the unchanged entries runs alongside the fetch
+        self._opened = asyncio.ensure_future(self._copy_unchanged())
+        return self
+
+    async def __aexit__(self, exc_type: type[BaseException] | None, *exc_info: object):
+        try:
+            with self.tracer.stage("finish archive"):
+                try:
+                    await self._wait_opened()
+                except BaseException:
+                    await self._run(self._close, False)
+                    raise
+                await self._run(self._close, exc_type is None)
+        finally:
+            self._writer.shutdown()
+            self._compressor.shutdown()
+
+    async def put(self, zip_path: str, content: Payload):
+        """Filter, compress and write a fetched file, replacing the entry at the same path.
+
+        Args:
+            zip_path: _normalized zip path of the entry the fetched file replaces_
+            content: _fetched content of the file_
+        """
+        transformed = await self.transform(zip_path, content) if self.transform is not None else content
+        compressed = await asyncio.get_running_loop().run_in_executor(
+            self._compressor, _compress, transformed, compress_type_for(zip_path))
+        await self._wait_opened()
+        await self._run(self._write_fetched, zip_path, compressed)
+
+    async def _run(self, func: Callable[..., object], *args: object):
+        await asyncio.get_running_loop().run_in_executor(self._writer, func, *args)
+
+    async def _copy_unchanged(self):
+        with self.tracer.stage("copy unchanged"):
+            await self._run(self._open)
+
+    async def _wait_opened(self):
+        """Wait for the copy of the unchanged entries, raising its error if it failed."""
+        assert self._opened is not None, "StreamingRepackager is not open"
+        # Shielded: a cancelled writer must not cancel the copy the others are waiting for too
+        await asyncio.shield(self._opened)
+
+    def _open(self):
+        self._source = zipfile.ZipFile(self.epub_path, 'r')
+        self._source_fp = open(self.epub_path, 'rb')
+        self._out = zipfile.ZipFile(self.out_epub, 'w')
+        # Write mimetype first, uncompressed
+        self._out.writestr("mimetype", self._source.read("mimetype"), compress_type=zipfile.ZIP_STORED)
+        for item in self._source.infolist():
+            zip_path = normalize_zip_path(item.filename)
+            if zip_path in SKIPPED_ENTRIES:
+                continue
+            if zip_path in self.replaced:
+                self._pending[zip_path] = item
+            else:
+                self._copy_raw(item)
+
+    def _write_fetched(self, zip_path: str, compressed: _Compressed):
+        data = compressed[4]
+        try:
+            item = self._pending.pop(zip_path, None)
+            if item is not None:
+                self._write_raw(item, compressed)
+                self.written += 1
+        finally:
+            if not isinstance(data, tuple):
+                data.close()
+
+    def _close(self, complete: bool):
+        try:
+            if complete:
+                # Keep the original content of entries that could not be fetched
+                for item in self._pending.values():
+                    self._copy_raw(item)
+        finally:
+            # Some of them are not open if the copy of the unchanged entries failed
+            for f in (self._out, self._source_fp, self._source):
+                if f is not None:
+                    f.close()
+        if not complete and self._out is not None:
+            os.remove(self.out_epub)
+
+    def _copy_raw(self, item: zipfile.ZipInfo):
+        """Copy an entry of the source epub without decompressing it."""
+        assert self._source_fp is not None
+        self._source_fp.seek(item.header_offset)
+        header = struct.unpack(zipfile.structFileHeader, self._source_fp.read(zipfile.sizeFileHeader))
+        # Skip the file name and extra field of the local header to get to the compressed data
+        self._source_fp.seek(header[10] + header[11], os.SEEK_CUR)
+        self._write_raw(item, (item.CRC, item.file_size, item.compress_type, item.compress_size, self._source_fp))
+
+    def _write_raw(self, item: zipfile.ZipInfo, compressed: _Compressed):
+        """Write an entry from already compressed data, reading `compress_size` bytes if it is a file."""
+        assert self._out is not None and self._out.fp is not None
+        crc, file_size, compress_type, compress_size, data = compressed
+        info = zipfile.ZipInfo(item.filename, item.date_time)
+        # Mode bits in external_attr are read according to the system the entry was created on
+        info.create_system = item.create_system
+        info.external_attr = item.external_attr
+        info.compress_type = compress_type
+        info.CRC = crc
+        info.file_size = file_size
+        info.compress_size = compress_size
+        out = self._out
+        info.header_offset = out.fp.tell()
+        out.fp.write(info.FileHeader(file_size > zipfile.ZIP64_LIMIT or compress_size > zipfile.ZIP64_LIMIT))
+        if isinstance(data, tuple):
+            for piece in data:
+                out.fp.write(piece)
+        else:
+            remaining = compress_size
+            while remaining > 0:
+                chunk = data.read(min(COPY_CHUNK_SIZE, remaining))
+                if not chunk:
+                    raise zipfile.BadZipFile(f"Truncated data for {item.filename}")
+                out.fp.write(chunk)
+                remaining -= len(chunk)
+        # Register the entry so it ends up in the central directory
+        out.filelist.append(info)
+        out.NameToInfo[info.filename] = info
+        out.start_dir = out.fp.tell()  # type: ignore
+        out._didModify = True  # type: ignore  # pylint: disable=protected-access
+
+
+def payload_size(content: Payload):
+    """Size of a payload in bytes, as it ends up in the repackaged epub before compression."""
+    if isinstance(content, str):
+        return len(content.encode("utf-8"))
+    if isinstance(content, (bytes, bytearray)):
+        return len(content)
+    return os.fstat(content.fileno()).st_size
+
+
+def compress_type_for(filename: str):
+    """Compression policy for replaced entries: store already compressed media, deflate everything else."""
+    return zipfile.ZIP_STORED if filename.lower().endswith(STORED_EXTENSIONS) else zipfile.ZIP_DEFLATED
+
+
+def _compress(content: Payload | Pieces, compress_type: int) -> _Compressed:
+    if isinstance(content, str):
+        content = content.encode("utf-8")
+    if isinstance(content, (bytes, bytearray)):
+        content = (content,)
+    if isinstance(content, tuple):
+        # The pieces are checksummed and compressed one after the other, without joining them first
+        crc = size = 0
+        for piece in content:
+            crc = zlib.crc32(piece, crc)
+            size += len(piece)
+        if compress_type == zipfile.ZIP_STORED:
+            return crc, size, compress_type, size, content
+        compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+        data = b"".join(compressor.compress(piece) for piece in content) + compressor.flush()
+        return crc, size, compress_type, len(data), (data,)
+
+    # Large payloads stay on disk, compressed piece by piece into another temporary file
+    crc = size = 0
+    content.seek(0)
+    if compress_type == zipfile.ZIP_STORED:
+        while chunk := content.read(COPY_CHUNK_SIZE):
+            crc = zlib.crc32(chunk, crc)
+            size += len(chunk)
+        content.seek(0)
+        return crc, size, compress_type, size, content
+    compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+    target = tempfile.TemporaryFile()
+    with content:
+        while chunk := content.read(COPY_CHUNK_SIZE):
+            crc = zlib.crc32(chunk, crc)
+            size += len(chunk)
+            target.write(compressor.compress(chunk))
+    target.write(compressor.flush())
+    compress_size = target.tell()
+    target.seek(0)
+    return crc, size, compress_type, compress_size, target
@@ -0,0 +1,162 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from typing import Awaitable, Callable, Generic, TypeVar
+
+from utils.trace import NULL_TRACER, Tracer
+
+T = TypeVar("T")
+
+logger = logging.getLogger(__name__)
+
+_Entry = tuple[int, int, str, Callable[[], Awaitable[T]], int]
+
+
+class AdaptiveScheduler(Generic[T]):
+    """Runs async jobs with a bounded concurrency limit that adapts to how fast the renderer keeps up.
+
+    Jobs are started largest first. The limit follows an additive-increase / multiplicative-decrease
+    policy: every job that completes raises it by roughly one per round of jobs, while a failed or timed
+    out job halves it, and so does a rise in the round trip latency reported with `observe` (at most once
+    per wave of in-flight jobs). Latency is compared against a running baseline, an exponentially weighted
+    moving average, so only renderer slowdowns count, not how long a round trip takes in absolute terms.
+    Failed jobs are retried with exponential backoff before being reported in `failed` or handed to their fallback.
+
+    Results are handed to the `consume` coroutine of `run` on tasks of their own, outside the timeout
+    of the job, so a job never has to be repeated because its result was slow to be stored, and the
+    time spent storing results never counts as renderer latency. At most `max_backlog` results are
+    consumed at the same time, no new jobs start while the backlog is full.
+
+    Usage:
+        scheduler = AdaptiveScheduler[bytes](max_concurrency=16)
+        scheduler.submit("cover.jpg", 250_000, lambda: fetch(...))
+        await scheduler.run(store)
+    """
+
+    def __init__(self, max_concurrency: int = 16, initial_concurrency: int = 4, min_concurrency: int = 1,
+                 latency_tolerance: float = 2.0, timeout: float = 60.0, max_retries: int = 3,
+                 retry_delay: float = 0.5, max_backlog: int | None = None, tracer: Tracer = NULL_TRACER):
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.limit = float(max(min_concurrency, min(initial_concurrency, max_concurrency)))
+        self.latency_tolerance = latency_tolerance
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.max_backlog = max_backlog or max_concurrency
+        self.tracer = tracer
+        self.failed: dict[str, BaseException] = {}
+        self.baseline_latency: float | None = None  # Slow moving average of the round trip latency
+        self.recent_latency: float | None = None  # Fast moving average of the round trip latency
+        self._queue: list[_Entry[T]] = []
+        self._fallbacks: dict[str, Callable[[], None]] = {}
+        self._order = itertools.count()
+        self._last_decrease = 0.0
+
+    def submit(self, key: str, size: int, job: Callable[[], Awaitable[T]], fallback: Callable[[], None] | None = None):
+        """Queue a job to be run by `run`.
+
+        Args:
+            key: _unique name of the job, used for results and error reporting_
+            size: _expected size of the resource in bytes, larger jobs are started first_
+            job: _factory returning a new awaitable for every attempt_
+            fallback: _called instead of reporting the job in `failed` once it exhausted its retries,
+                for example to submit its work again as smaller jobs_
+        """
+        if fallback is not None:
+            self._fallbacks[key] = fallback
+        heapq.heappush(self._queue, (-size, next(self._order), key, job, 0))
+
+    def observe(self, latency: float):
+        """Record the latency of one round trip to the renderer, backing off if it rose against the baseline.
+
+        Args:
+            latency: _seconds between sending a request and receiving its reply_
+        """
+        if self.baseline_latency is None or self.recent_latency is None:
+            self.baseline_latency = self.recent_latency = latency
+            return
+        self.baseline_latency += 0.05 * (latency - self.baseline_latency)
+        self.recent_latency += 0.3 * (latency - self.recent_latency)
+        if self.recent_latency > self.latency_tolerance * self.baseline_latency:
+            if self._decrease(time.monotonic() - latency):
+                self.recent_latency = self.baseline_latency
+
+    async def run(self, consume: Callable[[str, T], Awaitable[None]]):
+        """Run all queued jobs until they have succeeded or exhausted their retries.
+
+        Args:
+            consume: _coroutine function called with the key and result of every successful job_
+
+        Keys of jobs that failed on every attempt are listed in `failed` with their last error.
+        Errors raised by `consume` are not retried, they stop the run and are raised from it.
+        """
+        running: set[asyncio.Task[tuple[_Entry[T], T | None, BaseException | None, float]]] = set()
+        consuming: set[asyncio.Task[None]] = set()
+        waiting: set[asyncio.Task[None]] = set()
+
+        try:
+            while self._queue or running or consuming or waiting:
+                while self._queue and len(running) < int(self.limit) and len(consuming) < self.max_backlog:
+                    running.add(asyncio.create_task(self._attempt(heapq.heappop(self._queue))))
+
+                done, _ = await asyncio.wait(running | consuming | waiting, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task in waiting:
+                        waiting.discard(task)  # type: ignore
+                        continue
+                    if task in consuming:
+                        consuming.discard(task)  # type: ignore
+                        task.result()  # Raise errors of consume
+                        continue
+                    running.discard(task)  # type: ignore
+                    entry, result, error, started = task.result()  # type: ignore
+                    key, attempt = entry[2], entry[4]
+                    if error is None:
+                        consuming.add(asyncio.create_task(consume(key, result)))  # type: ignore
+                        self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+                        self.tracer.gauge("concurrency", self.limit)
+                        continue
+
+                    self._decrease(started)
+                    if attempt < self.max_retries:
+                        delay = self.retry_delay * 2 ** attempt
+                        logger.warning("Retrying %s in %.1fs (%d/%d): %r", key, delay, attempt + 1, self.max_retries,
+                                       error)
+                        self.tracer.record(key, retries=1)
+                        retry = (entry[0], entry[1], key, entry[3], attempt + 1)
+                        waiting.add(asyncio.create_task(self._requeue_later(retry, delay)))
+                    elif key in self._fallbacks:
+                        logger.warning("Failed to fetch %s, falling back: %r", key, error)
+                        self.tracer.record(key, failed=repr(error))
+                        self._fallbacks.pop(key)()
+                    else:
+                        logger.error("Failed to fetch %s: %r", key, error)
+                        self.tracer.record(key, failed=repr(error))
+                        self.failed[key] = error
+        finally:
+            for task in running | consuming | waiting:
+                task.cancel()
+
+    async def _attempt(self, entry: _Entry[T]):
+        started = time.monotonic()
+        try:
+            result = await asyncio.wait_for(entry[3](), self.timeout)
+        except Exception as e:  # pylint: disable=broad-except
+            return entry, None, e, started
+        return entry, result, None, started
+
+    async def _requeue_later(self, entry: _Entry[T], delay: float):
+        await asyncio.sleep(delay)
+        heapq.heappush(self._queue, entry)
+
+    def _decrease(self, started: float):
+        # Jobs started before the last decrease belong to the wave that already caused it
+        if started < self._last_decrease:
+            return False
+        self._last_decrease = time.monotonic()
+        self.limit = max(self.min_concurrency, self.limit / 2)
+        self.tracer.gauge("concurrency", self.limit)
+        return True
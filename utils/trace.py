@@ -0,0 +1,189 @@
+import json
+import sys
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Any, Iterator, TextIO
+
+TRACE_FORMATS = ("chrome", "json")
+
+
+class Tracer:
+    """Records where the time of a run goes: stage spans, per-resource records and counters.
+
+    Spans are timed with `span`/`stage` blocks. Numeric values passed to `record` are added up per key,
+    so retries and filter time accumulate over attempts. The recording can be written as a Chrome trace
+    (open it in chrome://tracing or https://ui.perfetto.dev) or as a plain JSON summary.
+    Pass `NULL_TRACER` instead to record nothing.
+
+    Usage:
+        tracer = Tracer()
+        with tracer.stage("fetch"):
+            ...
+        tracer.record("OEBPS/chapter1.xhtml", bytes=1024, fetch_latency=0.02)
+        tracer.write("trace.json")
+    """
+
+    enabled = True
+
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.spans: list[tuple[str, str, float, float, dict[str, Any]]] = []
+        self.records: dict[str, dict[str, Any]] = {}
+        self.counters: dict[str, int] = {}
+        self.gauges: list[tuple[str, float, float]] = []
+
+    @contextmanager
+    def span(self, name: str, category: str, **args: Any) -> Iterator[None]:
+        """Time the block as a span `name` of `category`, with `args` shown in the trace."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.spans.append((name, category, start, time.perf_counter(), args))
+
+    def stage(self, name: str):
+        """Time the block as one of the numbered stages of a run."""
+        return self.span(name, "stage")
+
+    def record(self, key: str, **values: Any):
+        """Add values to the record of a resource (or a batch of resources): numbers are summed, others replaced."""
+        record = self.records.setdefault(key, {})
+        for name, value in values.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool) and name in record:
+                record[name] += value
+            else:
+                record[name] = value
+
+    def count(self, name: str, n: int = 1):
+        """Increment a counter."""
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def gauge(self, name: str, value: float):
+        """Record the current value of something that changes over the run, like the concurrency limit."""
+        self.gauges.append((name, time.perf_counter(), value))
+
+    def summary(self) -> dict[str, Any]:
+        """The recording as a JSON-serializable summary, times in seconds since the tracer was created."""
+        stages: dict[str, dict[str, float]] = {}
+        for name, category, start, end, _ in self.spans:
+            if category == "stage":
+                stage = stages.setdefault(name, {"start": start - self.origin, "duration": 0.0})
+                stage["duration"] += end - start
+        return {
+            "total": time.perf_counter() - self.origin,
+            "stages": stages,
+            "resources": self.records,
+            "counters": self.counters,
+        }
+
+    def chrome_trace(self) -> dict[str, Any]:
+        """The recording in the Chrome trace event format."""
+        events: list[dict[str, Any]] = [
+            {"name": "process_name", "ph": "M", "pid": 1, "args": {"name": "lcp-epub-fetcher"}},
+        ]
+        # Overlapping spans of a category are spread over lanes, so none of them hides another
+        lanes: dict[str, list[float]] = {}
+        lane_ids: dict[tuple[str, int], int] = {}
+        for name, category, start, end, args in sorted(self.spans, key=lambda span: span[2]):
+            ends = lanes.setdefault(category, [])
+            lane = next((i for i, lane_end in enumerate(ends) if lane_end <= start), len(ends))
+            if lane == len(ends):
+                ends.append(end)
+                lane_ids[(category, lane)] = len(lane_ids) + 1
+                events.append({"name": "thread_name", "ph": "M", "pid": 1, "tid": lane_ids[(category, lane)],
+                               "args": {"name": f"{category} {lane + 1}" if lane else category}})
+            else:
+                ends[lane] = end
+            events.append({
+                "name": name, "cat": category, "ph": "X", "pid": 1, "tid": lane_ids[(category, lane)],
+                "ts": (start - self.origin) * 1e6, "dur": (end - start) * 1e6, "args": args,
+            })
+        for name, at, value in self.gauges:
+            events.append({"name": name, "ph": "C", "pid": 1, "ts": (at - self.origin) * 1e6, "args": {name: value}})
+        return {"traceEvents": events, "displayTimeUnit": "ms",
+                "metadata": {"counters": self.counters, "resources": self.records}}
+
+    def write(self, path: str, trace_format: str = "chrome"):
+        """Write the recording to a file.
+
+        Args:
+            path: _path of the file to write_
+            trace_format: _"chrome" for the Chrome trace event format, "json" for `summary`_
+        """
+        data = self.chrome_trace() if trace_format == "chrome" else self.summary()
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=1)
+
+
+class _NullTracer(Tracer):
+    """A tracer that records nothing, so instrumented code costs next to nothing when tracing is off."""
+
+    enabled = False
+
+    def span(self, name: str, category: str, **args: Any):  # type: ignore[override]
+        return nullcontext()
+
+    def stage(self, name: str):  # type: ignore[override]
+        return nullcontext()
+
+    def record(self, key: str, **values: Any):
+        pass
+
+    def count(self, name: str, n: int = 1):
+        pass
+
+    def gauge(self, name: str, value: float):
+        pass
+
+
+NULL_TRACER: Tracer = _NullTracer()
+
+
+class Progress:
+    """Live progress line with the number of fetched files, throughput and ETA.
+
+    The line is only drawn when the output is a terminal, and redrawn at most every `interval` seconds.
+
+    Usage:
+        progress = Progress(len(items), sum(item.size for item in items))
+        progress.update(item.size)
+        progress.close()
+    """
+
+    def __init__(self, total_files: int, total_bytes: int, stream: TextIO = sys.stdout, interval: float = 0.25):
+        self.total_files = total_files
+        self.total_bytes = total_bytes
+        self.stream = stream
+        self.interval = interval
+        self.files = 0
+        self.bytes = 0
+        self.enabled = stream.isatty()
+        self._start = time.monotonic()
+        self._last_draw = 0.0
+        self._width = 0
+
+    def update(self, size: int):
+        """Count a fetched file of `size` bytes."""
+        self.files += 1
+        self.bytes += size
+        if not self.enabled:
+            return
+        now = time.monotonic()
+        if now - self._last_draw >= self.interval or self.files == self.total_files:
+            self._last_draw = now
+            self._draw(now - self._start)
+
+    def close(self):
+        """End the progress line."""
+        if self.enabled and self._width:
+            self.stream.write("\n")
+            self.stream.flush()
+
+    def _draw(self, elapsed: float):
+        rate = self.bytes / elapsed if elapsed > 0 else 0.0
+        eta = f"{(self.total_bytes - self.bytes) / rate:.0f}s" if rate > 0 else "?"
+        line = (f"Fetched {self.files}/{self.total_files} files, "
+                f"{self.bytes / 1e6:.1f}/{self.total_bytes / 1e6:.1f} MB, {rate / 1e6:.1f} MB/s, ETA {eta}")
+        self.stream.write("\r" + line.ljust(self._width))
+        self.stream.flush()
+        self._width = len(line)
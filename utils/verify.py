@@ -0,0 +1,202 @@
+import asyncio
+import os
+import re
+import sys
+import zipfile
+import zlib
+from concurrent.futures import Executor
+from dataclasses import dataclass, field
+
+from utils.filter import declared_encoding
+from utils.manifest import ManifestIndex, ManifestItem, is_fetched, normalize_zip_path
+from utils.repackage import SKIPPED_ENTRIES
+
+# Leading bytes of binary media types, any of the (offset, signature) pairs must match
+MAGIC_BYTES: dict[str, tuple[tuple[int, bytes], ...]] = {
+    "image/jpeg": ((0, b"\xff\xd8\xff"),),
+    "image/png": ((0, b"\x89PNG\r\n\x1a\n"),),
+    "image/gif": ((0, b"GIF87a"), (0, b"GIF89a")),
+    "image/webp": ((8, b"WEBP"),),
+    "image/avif": ((4, b"ftyp"),),
+    "image/bmp": ((0, b"BM"),),
+    "font/woff": ((0, b"wOFF"),),
+    "application/font-woff": ((0, b"wOFF"),),
+    "font/woff2": ((0, b"wOF2"),),
+    "font/otf": ((0, b"OTTO"), (0, b"\x00\x01\x00\x00")),
+    "application/vnd.ms-opentype": ((0, b"OTTO"), (0, b"\x00\x01\x00\x00")),
+    "font/ttf": ((0, b"\x00\x01\x00\x00"), (0, b"true")),
+    "application/x-font-ttf": ((0, b"\x00\x01\x00\x00"), (0, b"true")),
+}
+# Media types checked as text
+TEXT_TYPES = ("application/xhtml+xml", "text/html", "text/css", "image/svg+xml")
+
+# Control characters that never occur in text documents; four of them close together are a run of ciphertext
+_CONTROL = rb"[\x00-\x08\x0b\x0e-\x1f\x7f]"
+_CIPHERTEXT_RE = re.compile(_CONTROL + rb"(?:(?:(?!" + _CONTROL + rb").){0,63}" + _CONTROL + rb"){3}", re.S)
+_CSS_CHARSET_RE = re.compile(rb'^(?:\xef\xbb\xbf)?@charset\s+"([A-Za-z][\w.:-]*)"')
+
+# (zip path, name in the archive, media type, whether it was fetched from Thorium Reader) of an entry to check
+_Entry = tuple[str, str, str, bool]
+
+
+@dataclass
+class VerificationReport:
+    """Outcome of `verify_epub`.
+
+    Attributes:
+        checked: _number of entries checked_
+        issues: _problem found with every damaged or still encrypted entry, by zip path_
+        refetch: _manifest items whose entries have issues and are fetched from Thorium Reader_
+        skipped: _zip paths of the entries listed in encryption.xml that are not fetched, see `is_fetched`_
+    """
+    checked: int = 0
+    issues: dict[str, str] = field(default_factory=dict)
+    skipped: list[str] = field(default_factory=list)
+    refetch: list[ManifestItem] = field(default_factory=list)
+
+    @property
+    def ok(self):
+        """Whether no issues were found."""
+        return not self.issues
+
+
+def check_content(data: bytes, media_type: str):
+    """Check that the content of a decrypted entry looks like its media type.
+
+    Text documents must decode in their declared encoding (UTF-8 by default) without runs of binary bytes,
+    binary media must start with their signature; other media types are not checked.
+
+    Returns:
+        A description of the problem, or None if the content looks fine.
+    """
+    if media_type.startswith(TEXT_TYPES):
+        if media_type.startswith("text/css"):
+            charset = _CSS_CHARSET_RE.match(data)
+            encoding = charset.group(1).decode("ascii") if charset is not None else "utf-8"
+        else:
+            encoding = declared_encoding(data)
+        try:
+            data.decode(encoding)
+        except UnicodeDecodeError as e:
+            return f"not valid {e.encoding} at byte {e.start}, looks encrypted"
+        except LookupError:
+            return f"unknown encoding {encoding}"
+        # Runs of control characters only mean something in encodings where text has none
+        if "<".encode(encoding) == b"<":
+            run = _CIPHERTEXT_RE.search(data)
+            if run is not None:
+                return f"binary bytes at byte {run.start()}, looks encrypted"
+    elif media_type in MAGIC_BYTES:
+        if not any(data[offset:offset + len(magic)] == magic for offset, magic in MAGIC_BYTES[media_type]):
+            return f"does not start like {media_type}, looks encrypted"
+    return None
+
+
+def check_entries(out_epub: str, epub_path: str, entries: list[_Entry]):
+    """Check entries of a repackaged epub, reading every one of them in full so its CRC is checked.
+
+    Fetched entries must differ from the source epub and have content matching their media type.
+
+    Args:
+        out_epub: _path to the repackaged epub_
+        epub_path: _path to the source epub_
+        entries: _entries to check, see `_Entry`_
+
+    Returns:
+        The problem found with every entry that has one, by zip path.
+    """
+    issues: dict[str, str] = {}
+    with zipfile.ZipFile(out_epub, 'r') as out, zipfile.ZipFile(epub_path, 'r') as source:
+        for zip_path, name, media_type, fetched in entries:
+            try:
+                data = out.read(name)
+            except (zipfile.BadZipFile, zlib.error, EOFError) as e:
+                issues[zip_path] = f"damaged entry: {e}"
+                continue
+            if not fetched:
+                continue
+            original = source.NameToInfo.get(name)
+            if original is not None and original.CRC == zlib.crc32(data) and original.file_size == len(data):
+                issues[zip_path] = "same as the encrypted original"
+                continue
+            problem = check_content(data, media_type)
+            if problem is not None:
+                issues[zip_path] = problem
+    return issues
+
+
+async def verify_epub(out_epub: str, epub_path: str, index: ManifestIndex, executor: Executor | None = None,
+                      workers: int | None = None):
+    """Verify a repackaged epub, checking its entries in parallel.
+
+    Every entry is read in full so its CRC is checked. Entries fetched from Thorium Reader must differ from
+    the source epub and their content must look like their media type, see `check_content`.
+    Fetched manifest items missing from the repackaged epub are reported too. Entries listed in encryption.xml
+    that are copied as is on purpose, like the navigation document, are listed as skipped instead.
+
+    Args:
+        out_epub: _path to the repackaged epub_
+        epub_path: _path to the source epub_
+        index: _manifest index of the source epub_
+        executor: _executor the checks run on, for example a process pool; in the calling thread if None_
+        workers: _number of parts the entries are split in, balanced by size; one per CPU if None_
+
+    Returns:
+        A `VerificationReport`.
+    """
+    with zipfile.ZipFile(out_epub, 'r') as out:
+        infos = [info for info in out.infolist() if normalize_zip_path(info.filename) not in SKIPPED_ENTRIES]
+    report = VerificationReport(checked=len(infos))
+
+    # Spread the entries over the parts largest first, so every part reads about the same number of bytes
+    parts: list[list[_Entry]] = [[] for _ in range(workers or os.cpu_count() or 1)]
+    sizes = [0] * len(parts)
+    present: set[str] = set()
+    for info in sorted(infos, key=lambda info: info.file_size, reverse=True):
+        zip_path = normalize_zip_path(info.filename)
+        present.add(zip_path)
+        item = index.get(zip_path)
+        media_type, fetched = (item.media_type, is_fetched(item)) if item is not None else ("", False)
+        smallest = sizes.index(min(sizes))
+        parts[smallest].append((zip_path, info.filename, media_type, fetched))
+        sizes[smallest] += info.file_size
+
+    loop = asyncio.get_running_loop()
+    results = await asyncio.gather(*(loop.run_in_executor(executor, check_entries, out_epub, epub_path, part)
+                                     for part in parts if part))
+    for issues in results:
+        report.issues.update(issues)
+    for item in index.encrypted_items():
+        if not is_fetched(item):
+            report.skipped.append(item.zip_path)
+        elif item.zip_path not in present:
+            report.issues[item.zip_path] = "missing from the repackaged epub"
+    report.issues = dict(sorted(report.issues.items()))
+    report.refetch = [item for zip_path in report.issues
+                      if (item := index.get(zip_path)) is not None and is_fetched(item)]
+    return report
+
+
+def print_report(report: VerificationReport):
+    """Print the issues of a verification report."""
+    if report.skipped:
+        print(f"Not fetched, copied still encrypted: {', '.join(report.skipped)}")
+    if report.ok:
+        print(f"Verified {report.checked} files, all fetched files were decrypted.")
+        return
+    print(f"Verification found problems with {len(report.issues)} of {report.checked} files:")
+    for zip_path, problem in report.issues.items():
+        print(f"  {zip_path}: {problem}")
+
+
+async def _verify(out_epub: str, epub_path: str):
+    report = await verify_epub(out_epub, epub_path, ManifestIndex.from_epub(epub_path))
+    print_report(report)
+    return report.ok
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("Usage: python -m utils.verify <fetched epub> <source epub>")
+        sys.exit(2)
+    sys.exit(0 if asyncio.run(_verify(sys.argv[1], sys.argv[2])) else 1)